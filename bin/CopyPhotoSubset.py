@@ -24,41 +24,502 @@ face tags, but it could be a directory name) into d:\photos. The copying
 preserves the directory structure except that the first three levels of the
 directory structure are removed, so "C:\Users\Public\Pictures\2013\2013_10"
 becomes just "2013\2013_10"
+
+To avoid scanning the entire database on every run a sidecar index
+(PhotoDatabase.index.sqlite) maps each word in the database - including the
+words of face tags and path components - to the offsets of the lines that
+contain it. The index is rebuilt whenever the database's size or modification
+time changes. --text can be specified multiple times, in which case photos must
+match all of the strings, or any of them if --any is specified. Each word of a
+string is looked up as a sub-string of the indexed words, so partial words such
+as "Daws" find the same photos as --scan, which skips the index. When the index
+matches a large fraction of the lines the database is scanned anyway, since
+reading it sequentially is faster than seeking to each line.
+
+Copying is done by a pool of --workers threads since copying to a slow flash
+drive is latency bound. Files whose destination already has the same size and
+modification time are skipped, and completed copies are recorded in a manifest
+in the destination directory so that an interrupted run can resume without
+checking every target again. With --dedup, files whose contents match a file
+that has already been copied are hardlinked to it instead, with the content
+hashes cached in ~\Documents\PhotoHashCache.sqlite.
 """
 
 import argparse
+import array
+import bisect
+import collections
+import concurrent.futures
+import errno
+import hashlib
+import instrumentation
 import os
+import re
 import shutil
+import sqlite3
+import time
+import utf16_database
+
+# Increment this when the layout of the index changes so that old indexes are
+# rebuilt.
+index_version = 2
+
+# When the index narrows the search to more than this fraction of the lines it
+# is faster to read the whole database sequentially than to seek to each line.
+scan_fraction = 0.2
+
+def Tokenize(text):
+  """
+  Return the set of lower-case words in text.
+  """
+  return set(re.findall(r'\w+', text.lower()))
+
+def BuildIndex(database_path, index_path):
+  """
+  Create an index that maps each word in the database to an array of the byte
+  offsets of the lines that contain it, along with the offset and byte length
+  of every line.
+  """
+  stat = os.stat(database_path)
+  encoding = utf16_database.GetEncoding(database_path)[0]
+  postings = {}
+  line_offsets = array.array('Q')
+  line_lengths = array.array('L')
+  for offset, length, line in utf16_database.ReadLines(database_path,
+                                                       with_offsets=True):
+    line_offsets.append(offset)
+    line_lengths.append(length)
+    for token in Tokenize(line):
+      postings.setdefault(token, array.array('Q')).append(offset)
+
+  # Build the index under a temporary name so that an interrupted build doesn't
+  # leave a partial index that looks valid.
+  temp_path = index_path + '.tmp'
+  if os.path.exists(temp_path):
+    os.remove(temp_path)
+  conn = sqlite3.connect(temp_path)
+  with conn:
+    conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value)')
+    conn.execute('CREATE TABLE postings (token TEXT PRIMARY KEY, offsets BLOB) '
+                 'WITHOUT ROWID')
+    conn.execute('CREATE TABLE lines (offsets BLOB, lengths BLOB)')
+    conn.executemany('INSERT INTO meta VALUES (?, ?)',
+                     [('version', index_version), ('size', stat.st_size),
+                      ('mtime', stat.st_mtime), ('encoding', encoding),
+                      ('lines', len(line_offsets))])
+    conn.execute('INSERT INTO lines VALUES (?, ?)',
+                 (line_offsets.tobytes(), line_lengths.tobytes()))
+    # Inserting in key order avoids repeatedly splitting the b-tree pages,
+    # which is very slow when some of the rows are large.
+    conn.executemany('INSERT INTO postings VALUES (?, ?)',
+                     ((token, offsets.tobytes()) for token, offsets in
+                      sorted(postings.items())))
+  conn.close()
+  os.replace(temp_path, index_path)
+
+def OpenIndex(database_path, index_path):
+  """
+  Return a connection to the index for the database and the index's metadata,
+  rebuilding the index first if it is missing or out of date.
+  """
+  stat = os.stat(database_path)
+  for attempt in range(2):
+    if os.path.exists(index_path):
+      conn = sqlite3.connect(index_path)
+      try:
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        if (meta.get('version') == index_version and
+            meta.get('size') == stat.st_size and
+            meta.get('mtime') == stat.st_mtime):
+          return conn, meta
+      except sqlite3.DatabaseError:
+        pass
+      conn.close()
+    print('Building index of %s.' % database_path)
+    with instrumentation.Phase('build index'):
+      BuildIndex(database_path, index_path)
+  raise Exception('Failed to build index for %s.' % database_path)
+
+def Intersect(postings):
+  """
+  Return the offsets that are in all of the sorted posting arrays. Each offset
+  in the shortest array is looked up in the others with a binary search, so the
+  cost depends mostly on the length of the shortest array.
+  """
+  postings = sorted(postings, key=len)
+  result = postings[0]
+  for offsets in postings[1:]:
+    if not result:
+      break
+    found = []
+    for offset in result:
+      index = bisect.bisect_left(offsets, offset)
+      if index < len(offsets) and offsets[index] == offset:
+        found.append(offset)
+    result = found
+  return list(result)
+
+def FindTokenOffsets(conn, token):
+  """
+  Return the sorted offsets of the lines that contain a word that contains
+  token. Any line that contains a needle contains such a word for each of the
+  needle's words, even if the needle starts or ends part way through a word.
+  """
+  rows = conn.execute('SELECT offsets FROM postings WHERE instr(token, ?) > 0',
+                      (token,)).fetchall()
+  if len(rows) == 1:
+    return array.array('Q', rows[0][0])
+  offsets = set()
+  for row in rows:
+    offsets.update(array.array('Q', row[0]))
+  return sorted(offsets)
+
+def FindLineOffsets(conn, needles, match_any):
+  """
+  Return the sorted offsets of the candidate lines for all of the needles, or
+  any of them if match_any is True. The candidates contain every word of the
+  needles, possibly as part of a longer word, so they still need to be checked
+  for the exact strings. Returns None if a needle contains no words, since that
+  can't be answered from the index.
+  """
+  groups = []
+  for needle in needles:
+    tokens = Tokenize(needle)
+    if not tokens:
+      return None
+    postings = []
+    for token in tokens:
+      postings.append(FindTokenOffsets(conn, token))
+    groups.append(postings)
+  if match_any:
+    return sorted(set().union(*(Intersect(postings) for postings in groups)))
+  # Every word of every needle must be present, so intersect them all at once.
+  return Intersect([offsets for postings in groups for offsets in postings])
+
+def FindLines(database_path, needles, match_any, scan):
+  """
+  Generate the database lines that contain all of the needles, or any of them
+  if match_any is True.
+  """
+  if match_any:
+    matches = lambda line: any(needle in line for needle in needles)
+  else:
+    matches = lambda line: all(needle in line for needle in needles)
+
+  if not scan:
+    index_path = os.path.splitext(database_path)[0] + '.index.sqlite'
+    conn, meta = OpenIndex(database_path, index_path)
+    offsets = FindLineOffsets(conn, needles, match_any)
+    if offsets is not None and len(offsets) <= scan_fraction * meta['lines']:
+      print('Index found %d candidate lines.' % len(offsets))
+      row = conn.execute('SELECT offsets, lengths FROM lines').fetchone()
+      conn.close()
+      line_offsets = array.array('Q', row[0])
+      line_lengths = array.array('L', row[1])
+      with open(database_path, 'rb') as f:
+        for offset in offsets:
+          length = line_lengths[bisect.bisect_left(line_offsets, offset)]
+          # The index only matches words so check for the exact strings.
+          line = utf16_database.ReadLineAt(f, offset, meta['encoding'], length)
+          if matches(line):
+            yield line
+      return
+    conn.close()
+    if offsets is not None:
+      print('Index found %d candidate lines, scanning the database instead.' %
+            len(offsets))
 
+  count = 0
+  for line in utf16_database.ReadLines(database_path):
+    count += 1
+    if matches(line):
+      yield line
+  print('Read %s lines.' % count)
+
+def CopyFile(src, dst):
+  """
+  Copy src to dst along with its timestamps, using an in-kernel copy where
+  available.
+  """
+  if hasattr(os, 'copy_file_range'):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+      size = os.fstat(fsrc.fileno()).st_size
+      copied = 0
+      try:
+        while copied < size:
+          count = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                     min(size - copied, 1 << 30))
+          if count == 0:
+            break
+          copied += count
+      except OSError as e:
+        # Copying between some file systems isn't supported, so fall back to a
+        # regular copy.
+        if e.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                           errno.EOPNOTSUPP, errno.EPERM]:
+          raise
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 1 << 20)
+  else:
+    # This uses sendfile on Linux and fcopyfile on macOS.
+    shutil.copyfile(src, dst)
+  shutil.copystat(src, dst)
+
+def IsUpToDate(dst, stat):
+  """
+  Return True if dst exists and has the same size and mtime as the source file.
+  """
+  try:
+    dst_stat = os.stat(dst)
+  except OSError:
+    return False
+  # FAT file systems, as used on many flash drives, store times with a two
+  # second resolution.
+  return (dst_stat.st_size == stat.st_size and
+          abs(dst_stat.st_mtime - stat.st_mtime) <= 2)
+
+def CopyIfNeeded(src, dst, manifest_entry, link_target=None):
+  """
+  Copy src to dst unless the manifest or the destination shows that it is
+  already there. If link_target is specified then it is an already copied file
+  with the same contents as src, and dst is created as a hardlink to it. Returns
+  a (size, mtime, status) tuple where status is 'recorded' if the manifest
+  already records the copy, 'current' if dst was already up to date, 'copied',
+  'linked', or 'unlinkable' if the destination file system doesn't support
+  hardlinks.
+  """
+  stat = os.stat(src)
+  if manifest_entry == (stat.st_size, stat.st_mtime):
+    return stat.st_size, stat.st_mtime, 'recorded'
+  if IsUpToDate(dst, stat):
+    return stat.st_size, stat.st_mtime, 'current'
+  if link_target and os.path.exists(link_target):
+    if os.path.lexists(dst):
+      os.remove(dst)
+    try:
+      os.link(link_target, dst)
+    except OSError:
+      return stat.st_size, stat.st_mtime, 'unlinkable'
+    return stat.st_size, stat.st_mtime, 'linked'
+  CopyFile(src, dst)
+  return stat.st_size, stat.st_mtime, 'copied'
+
+def HashFile(path):
+  """
+  Return the SHA-256 hash of the contents of the specified file.
+  """
+  hash = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while True:
+      chunk = f.read(1 << 20)
+      if not chunk:
+        break
+      hash.update(chunk)
+  return hash.hexdigest()
+
+def FindDuplicates(copies, hash_cache_path, workers):
+  """
+  Return a dictionary that maps the destination of each duplicate in the list
+  of (source, destination) paths to the destination of the first file with the
+  same contents. Only files whose size matches another file are hashed, and the
+  hashes are cached in an SQLite database keyed by path, size, and mtime.
+  """
+  stats = {}
+  for src, dst in copies:
+    try:
+      stats[src] = os.stat(src)
+    except OSError:
+      # CopyFiles will report this.
+      pass
+  size_counts = collections.Counter(stat.st_size for stat in stats.values())
+  candidates = [(src, dst) for src, dst in copies
+                if src in stats and size_counts[stats[src].st_size] > 1]
+
+  conn = sqlite3.connect(hash_cache_path)
+  conn.execute('CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, '
+               'size INTEGER, mtime REAL, hash TEXT)')
+  hashes = {}
+  to_hash = []
+  for src, dst in candidates:
+    row = conn.execute('SELECT hash FROM hashes WHERE path = ? AND size = ? AND '
+                       'mtime = ?', (src, stats[src].st_size,
+                                     stats[src].st_mtime)).fetchone()
+    if row:
+      hashes[src] = row[0]
+    else:
+      to_hash.append(src)
+  if to_hash:
+    print('Hashing %d files.' % len(to_hash))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+      futures = {executor.submit(HashFile, src): src for src in to_hash}
+      for future in concurrent.futures.as_completed(futures):
+        src = futures[future]
+        try:
+          hashes[src] = future.result()
+        except OSError as e:
+          print('Failure hashing %s - %s' % (src, e))
+    with conn:
+      conn.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)',
+                       [(src, stats[src].st_size, stats[src].st_mtime,
+                         hashes[src]) for src in to_hash if src in hashes])
+  conn.close()
+
+  first_copies = {}
+  duplicates = {}
+  for src, dst in candidates:
+    if src not in hashes:
+      continue
+    key = (stats[src].st_size, hashes[src])
+    if key in first_copies:
+      duplicates[dst] = first_copies[key]
+    else:
+      first_copies[key] = dst
+  return duplicates
+
+def LoadManifest(manifest_path):
+  """
+  Return a dictionary of destination path: (size, mtime) for the copies that
+  have previously completed.
+  """
+  manifest = {}
+  try:
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+      for line in f:
+        parts = line.rstrip('\n').split('\t')
+        # Ignore a partially written last line.
+        if len(parts) == 3:
+          manifest[parts[0]] = (int(parts[1]), float(parts[2]))
+  except OSError:
+    pass
+  return manifest
+
+def CopyFiles(copies, manifest_path, workers, duplicates=None):
+  """
+  Copy a list of (source, destination) paths using a pool of threads, recording
+  each completed copy in the manifest, and print a throughput summary. Files
+  whose destination is in duplicates are hardlinked to the destination that it
+  maps to, after all other files have been copied. Duplicates that can't be
+  linked are skipped and listed in a report in the destination directory.
+  """
+  start = time.time()
+  duplicates = duplicates or {}
+  manifest = LoadManifest(manifest_path)
+  # Create all of the destination directories up front so that the workers
+  # don't need to check.
+  for dir in sorted(set(os.path.dirname(dst) for src, dst in copies)):
+    os.makedirs(dir, exist_ok=True)
+
+  counts = collections.Counter()
+  copied_bytes = 0
+  unlinkable = []
+  with open(manifest_path, 'a', encoding='utf-8') as manifest_file, \
+       concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    # The link targets have to exist before the duplicates can be linked to
+    # them, so the duplicates are done as a second batch.
+    for batch in [[(src, dst) for src, dst in copies if dst not in duplicates],
+                  [(src, dst) for src, dst in copies if dst in duplicates]]:
+      futures = {executor.submit(CopyIfNeeded, src, dst, manifest.get(dst),
+                                 duplicates.get(dst)): (src, dst)
+                 for src, dst in batch}
+      for future in concurrent.futures.as_completed(futures):
+        src, dst = futures[future]
+        try:
+          size, mtime, status = future.result()
+        except Exception as e:
+          print('Failure copying %s to %s - %s' % (src, dst, e))
+          counts['failed'] += 1
+          continue
+        counts[status] += 1
+        if status == 'copied':
+          print('Copied from %s to %s' % (src, dst))
+          copied_bytes += size
+        elif status == 'linked':
+          print('Linked %s to %s' % (dst, duplicates[dst]))
+        elif status == 'unlinkable':
+          unlinkable.append((dst, duplicates[dst]))
+        if status in ['current', 'copied', 'linked']:
+          manifest_file.write('%s\t%d\t%r\n' % (dst, size, mtime))
+          manifest_file.flush()
+
+  elapsed = max(time.time() - start, 1e-6)
+  print('Copied %d files totaling %1.3f GB in %1.1f s (%1.1f MB/s, %1.1f '
+        'files/s), skipped %d.' % (counts['copied'], copied_bytes / 1e9,
+                                   elapsed, copied_bytes / 1e6 / elapsed,
+                                   counts['copied'] / elapsed,
+                                   counts['recorded'] + counts['current']))
+  instrumentation.Count('files', counts['copied'])
+  instrumentation.Count('bytes', copied_bytes)
+  if counts['linked'] > 0:
+    print('Linked %d duplicate file(s)' % counts['linked'])
+  if unlinkable:
+    report_path = os.path.join(os.path.dirname(manifest_path),
+                               'CopyPhotoSubsetDuplicates.txt')
+    with open(report_path, 'w', encoding='utf-8') as f:
+      for dst, link_target in sorted(unlinkable):
+        f.write('%s\t%s\n' % (dst, link_target))
+    print('Skipped %d duplicate file(s) that could not be linked, see %s' %
+          (len(unlinkable), report_path))
+  if counts['failed'] > 0:
+    print('Failed to copy %d file(s)' % counts['failed'])
 
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--text', help='Text to search for.',
-                      required=True)
+  parser.add_argument('--text', help='Text to search for. Can be specified '
+                      'multiple times.', required=True, action='append')
   parser.add_argument('--dest', help='Destination directory.',
                       required=True)
+  parser.add_argument('--any', help='Copy photos that match any --text rather '
+                      'than all of them.', action='store_true')
+  parser.add_argument('--scan', help='Scan the entire database for the '
+                      'strings instead of using the index.',
+                      action='store_true')
+  parser.add_argument('--workers', help='Number of files to copy '
+                      'concurrently.', type=int, default=4)
+  parser.add_argument('--dedup', help='Hardlink files whose contents match a '
+                      'file that has already been copied instead of copying '
+                      'them again.', action='store_true')
+  parser.add_argument('--database', help='Photo database to search. Defaults '
+                      r'to ~\Documents\PhotoDatabase.txt.')
+  parser.add_argument('--strip', help='Number of leading components of each '
+                      'photo path to drop when forming the destination path.',
+                      type=int, default=4)
+  instrumentation.AddArguments(parser)
   args = parser.parse_args()
-  needle = args.text
+  instrumentation.Start('CopyPhotoSubset', args)
+  needles = args.text
   dest = args.dest
 
-  print('Copying all files containing "%s" to %s.' % (needle, dest))
+  print('Copying all files containing %s to %s.' %
+        ((' or ' if args.any else ' and ').join('"%s"' % needle for needle in
+                                               needles), dest))
 
   database_dir = os.path.expanduser(r'~\Documents')
   database_path = os.path.join(database_dir, 'PhotoDatabase.txt')
-  with open(database_path, 'rb') as f:
-    lines = f.read().decode('utf-16').splitlines()
-  print('Read %s lines.' % len(lines))
-  for line in lines:
-    if line.count(needle) > 0:
+  if args.database:
+    database_path = args.database
+    database_dir = os.path.dirname(os.path.abspath(database_path))
+  copies = []
+  with instrumentation.Phase('select'):
+    for line in FindLines(database_path, needles, args.any, args.scan):
       parts = line.split('\t')
       path = parts[0]
-      sub_path = '\\'.join(path.split('\\')[4:])
-      output_path = os.path.join(dest, sub_path)
-      if not os.path.exists(output_path):
-        print('Copying from %s to %s' % (path, output_path))
-        dir = os.path.split(output_path)[0]
-        os.makedirs(dir, exist_ok=True)
-        shutil.copy2(path, output_path)
+      # The paths are usually Windows paths but allow either separator.
+      sub_path = re.split(r'[\\/]', path)[args.strip:]
+      output_path = os.path.join(dest, *sub_path)
+      copies.append((path, output_path))
+    instrumentation.Count('files', len(copies))
+  os.makedirs(dest, exist_ok=True)
+  manifest_path = os.path.join(dest, 'CopyPhotoSubsetManifest.txt')
+  duplicates = {}
+  if args.dedup:
+    hash_cache_path = os.path.join(database_dir, 'PhotoHashCache.sqlite')
+    with instrumentation.Phase('dedup'):
+      duplicates = FindDuplicates(copies, hash_cache_path, args.workers)
+    print('Found %d duplicate files.' % len(duplicates))
+  with instrumentation.Phase('copy'):
+    CopyFiles(copies, manifest_path, args.workers, duplicates)
 
 if __name__ == '__main__':
   main()
@@ -16,11 +16,16 @@
 This script randomly selects a 5-star photo from the user's pictures folder or
 the public pictures folder.
 
-This script uses PIL/Pillow to scan the images and extract rating tags. It
-caches the results in a text file that holds the path, last-modified time, and
-rating (tab separated). It can either update the database occasionally (every
-now and then) or it can get the file list and update the database whenever the
-count changes.
+This script reads the JPEG headers directly to extract rating tags, falling
+back to PIL/Pillow for files that the minimal parser can't handle. It caches the
+results in an SQLite database that holds the path, last-modified time, and
+rating, indexed by rating so that picking a photo only touches the matching
+rows. The original UTF-16 tab-separated text format, which some C# tools also
+read, can be imported and exported with --import-text and --export-text. It can
+either update the database occasionally (every now and then)
+or it can get the file list and update the database whenever the set of files
+changes. The file list is kept up to date with a per-directory index so that
+only directories whose modification time has changed need to be listed.
 
 A list of the photos that have been displayed is kept. This list could be used
 to avoid repetition, but given a sufficiently large number of photos there
@@ -30,18 +35,34 @@ what pictures have been shown.
 
 This can be set as a scheduled task that runs every five minutes or so. In this
 context it is important to run it using pythonw.exe so that no console window
-pops up.
+pops up. Alternately it can be started once with --daemon, in which case it
+keeps the list of eligible photos in memory, changes the wallpaper on a timer,
+and polls for picture changes on a background thread.
+
+Setting a multi-megapixel original as the wallpaper is slow and memory hungry,
+so --cache-size enables a cache of eligible photos that have been pre-scaled to
+the screen size. The cache is filled ahead of time - continuously in --daemon
+mode, a few photos per run otherwise - and the least recently displayed photos
+are evicted when it exceeds its size budget.
 """
 
 import argparse
+import concurrent.futures
+import contextlib
 import ctypes
 import datetime
+import hashlib
+import instrumentation
+import json
 import os
-# To make this available you need to install Pillow with this command:
-# pip3 install pillow
-from PIL import Image, ExifTags
 import random
+import sqlite3
+import struct
+import threading
 import time
+import utf16_database
+
+rating_tag = 18246
 
 # Uses the documents directory to store the database of files and their
 # attributes, and other status information.
@@ -54,126 +75,827 @@ import time
 # difficult to view.
 database_dir = os.path.expanduser(r'~\Documents')
 
+def ScanPictureDirectories(directories, old_index):
+  """
+  Scan the specified directories for .jpg files and return a list of file paths
+  and an updated directory index. The index maps each directory path to its
+  mtime, .jpg file names, and sub-directory names. Directories whose mtime
+  matches old_index are not listed again - only stat'ed - since adding, removing,
+  or renaming an entry updates the mtime of the containing directory.
+  """
+  result = []
+  index = {}
+  pending = list(directories)
+  while pending:
+    root = pending.pop()
+    try:
+      mtime = os.stat(root).st_mtime
+    except OSError:
+      # Missing directories are skipped, as os.walk does.
+      continue
+    entry = old_index.get(root)
+    if not entry or entry['mtime'] != mtime:
+      files = []
+      dirs = []
+      try:
+        with os.scandir(root) as it:
+          for dir_entry in it:
+            if dir_entry.is_dir(follow_symlinks=False):
+              dirs.append(dir_entry.name)
+            elif os.path.splitext(dir_entry.name)[1].lower() in ['.jpg']:
+              files.append(dir_entry.name)
+      except OSError:
+        continue
+      entry = {'mtime': mtime, 'files': files, 'dirs': dirs}
+    index[root] = entry
+    for name in entry['files']:
+      result.append(os.path.join(root, name))
+    for name in entry['dirs']:
+      pending.append(os.path.join(root, name))
+  return result, index
+
 def GetPicturePaths(directories):
   """
   Scan the specified directories for .jpg files and return a list of file paths.
   """
-  result = []
-  for directory in directories:
-    for root, dirs, files in os.walk(directory, topdown=False):
-      for name in files:
-        ext = os.path.splitext(name)[1].lower()
-        if ext.lower() in ['.jpg']:
-          result.append(os.path.join(root, name))
-  return result
+  return ScanPictureDirectories(directories, {})[0]
 
-def main():
-  parser = argparse.ArgumentParser()
-  parser.add_argument('--showall', help='If specified then show all pictures '
-                      'instead of just five-star images',
-                      action='store_true')
-  args = parser.parse_args()
+def LoadDirectoryIndex(index_path):
+  """
+  Load the directory index written by SaveDirectoryIndex, returning an empty
+  index if it doesn't exist or can't be read.
+  """
+  try:
+    with open(index_path, 'r', encoding='utf-8') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
 
-  verbose = True
-  database_path = os.path.join(database_dir, 'WallpaperPhotoDatabase.txt')
+def SaveDirectoryIndex(index_path, index):
+  """
+  Save the index for LoadDirectoryIndex. The file is replaced with os.replace
+  so a crash mid-write leaves the previous index.
+  """
+  temp_path = index_path + '.tmp'
+  with open(temp_path, 'w', encoding='utf-8') as f:
+    json.dump(index, f)
+  os.replace(temp_path, index_path)
+
+def ReadJpegRating(path):
+  """
+  Return the rating from the EXIF IFD0 of the specified JPEG file by walking the
+  JPEG markers, reading just the headers rather than decoding the image. Returns
+  0 if there is no EXIF data or no rating tag. Raises ValueError if the file is
+  not something this minimal parser understands.
+  """
+  with open(path, 'rb') as f:
+    if f.read(2) != b'\xff\xd8':
+      raise ValueError('Not a JPEG file')
+    while True:
+      header = f.read(4)
+      if len(header) < 4 or header[0] != 0xff:
+        raise ValueError('Bad JPEG marker')
+      marker = header[1]
+      # Markers may be preceded by any number of 0xff fill bytes.
+      while marker == 0xff:
+        header = header[1:] + f.read(1)
+        if len(header) < 4:
+          raise ValueError('Bad JPEG marker')
+        marker = header[1]
+      # EXIF data must come before the image data, so stop at start-of-scan or
+      # end-of-image.
+      if marker in [0xda, 0xd9]:
+        return 0
+      length = struct.unpack('>H', header[2:])[0]
+      if length < 2:
+        raise ValueError('Bad JPEG segment length')
+      if marker == 0xe1:
+        segment = f.read(length - 2)
+        # APP1 is also used for XMP so check for the EXIF signature.
+        if segment.startswith(b'Exif\0\0'):
+          return ParseExifRating(segment[6:])
+      else:
+        f.seek(length - 2, os.SEEK_CUR)
+
+def ParseExifRating(tiff):
+  """
+  Return the rating tag from IFD0 of the TIFF structure embedded in an EXIF
+  segment, or 0 if it is not present.
+  """
+  if tiff[:2] == b'II':
+    order = '<'
+  elif tiff[:2] == b'MM':
+    order = '>'
+  else:
+    raise ValueError('Bad TIFF byte order')
+  magic, ifd_offset = struct.unpack(order + 'HI', tiff[2:8])
+  if magic != 42:
+    raise ValueError('Bad TIFF header')
+  entry_count = struct.unpack(order + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+  for i in range(entry_count):
+    start = ifd_offset + 2 + i * 12
+    tag, type, count = struct.unpack(order + 'HHI', tiff[start:start + 8])
+    if tag != rating_tag:
+      continue
+    # The rating is a single BYTE, SHORT, or LONG stored in the value field.
+    formats = {1: 'B', 3: 'H', 4: 'I'}
+    if count != 1 or type not in formats:
+      raise ValueError('Unexpected rating tag type %d' % type)
+    return struct.unpack_from(order + formats[type], tiff, start + 8)[0]
+  return 0
+
+def ReadPillowRating(path):
+  """
+  Return the rating from the specified photo using Pillow. This is slower than
+  ReadJpegRating but handles any file that Pillow handles.
+  """
+  # To make this available you need to install Pillow with this command:
+  # pip3 install pillow
+  # It is imported here so that the common case doesn't pay the import cost.
+  from PIL import Image
+  # Set a larger decompression bomb level. Could set this to None to disable
+  # compression bomb warnings entirely.
+  Image.MAX_IMAGE_PIXELS = 300000000
+  with Image.open(path) as img:
+    img_exif = img.getexif()
+    return img_exif.get(rating_tag, 0)
+
+def ReadRating(path):
+  """
+  Return a (rating, error) tuple for the specified photo. Decode errors are
+  returned rather than raised so that one corrupt file doesn't abort a rebuild.
+  This runs in worker processes when --jobs is used.
+  """
   try:
-    # 'utf-16' is not a sensible choice. I think I chose it because C# defaults
-    # to that encoding and I have some image processing tools written in C#.
-    lines = open(database_path, 'rb').read().decode('utf-16').splitlines()
-  except:
-    # If the database doesn't exist then create an empty one.
-    lines = []
-
-  old_database = {}
-  for line in lines:
-    path, mtime, rating = line.split('\t')
-    old_database[path] = (float(mtime), int(rating))
+    try:
+      return ReadJpegRating(path), None
+    except (ValueError, struct.error):
+      return ReadPillowRating(path), None
+  except Exception as e:
+    return 0, str(e)
 
-  mypictures = os.path.expanduser(r'~\Pictures')
-  publicpictures = os.path.normpath(os.path.expanduser(r'~\..\public\Pictures'))
-  # Set this to the list of directories to be scanned.
-  directories = [mypictures, publicpictures]
+def ScanRatings(paths, jobs):
+  """
+  Generate (rating, error) tuples for the specified paths, in order. If jobs is
+  greater than one then the work is spread over a pool of processes.
+  """
+  if jobs <= 1 or len(paths) < 2:
+    for path in paths:
+      yield ReadRating(path)
+    return
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    # Batching amortizes the inter-process overhead, which is significant
+    # compared to reading the EXIF data from a single file.
+    chunksize = max(1, min(64, len(paths) // (jobs * 4)))
+    yield from executor.map(ReadRating, paths, chunksize=chunksize)
 
-  # Scanning the entire picture directory is fast if it is cached, and gives a
-  # quite reliable way to detect when new pictures appear or disappear. But it
-  # is not free, especially on slow hard drives. Set detect_changes to True to
-  # get updates whenever the file count changes.
-  detect_changes = True
-  if detect_changes:
-    picture_list = GetPicturePaths(directories)
+def OpenDatabase(database_path):
+  """
+  Open the SQLite photo database, creating the table and the rating index if
+  necessary.
+  """
+  conn = sqlite3.connect(database_path)
+  conn.execute('CREATE TABLE IF NOT EXISTS photos (path TEXT PRIMARY KEY, '
+               'mtime REAL NOT NULL, rating INTEGER NOT NULL)')
+  # Including the path makes this a covering index for selection.
+  conn.execute('CREATE INDEX IF NOT EXISTS photos_by_rating '
+               'ON photos (rating, path)')
+  return conn
 
-  # Recreate the database if it doesn't exist or if the file count has changed.
-  if not old_database or (detect_changes and len(picture_list) != len(old_database)):
-    if verbose:
-      print('Updating database from %d to %d pictures.' % (len(old_database), len(picture_list)))
+def LoadDatabase(conn):
+  """
+  Return the entire database as a dictionary of path: (mtime, rating).
+  """
+  return {path: (mtime, rating) for path, mtime, rating in
+          conn.execute('SELECT path, mtime, rating FROM photos')}
 
-    if not detect_changes:
-      picture_list = GetPicturePaths(directories)
-    # Set a larger decompression bomb level. Could set this to None to disable
-    # compression bomb warnings entirely.
-    Image.MAX_IMAGE_PIXELS = 300000000
+def UpdateDatabase(conn, old_database, new_database):
+  """
+  Apply the differences between old_database and new_database to the SQLite
+  database in a single transaction so that an interrupted update leaves the
+  previous contents intact.
+  """
+  removed = [(path,) for path in old_database.keys() - new_database.keys()]
+  changed = [(path, mtime, rating) for path, (mtime, rating) in
+             new_database.items() if old_database.get(path) != (mtime, rating)]
+  with conn:
+    conn.executemany('DELETE FROM photos WHERE path = ?', removed)
+    conn.executemany('INSERT OR REPLACE INTO photos VALUES (?, ?, ?)', changed)
+
+def CountPictures(conn, rating=None):
+  """
+  Return the number of pictures with the specified rating, or all pictures if
+  rating is None.
+  """
+  if rating is None:
+    return conn.execute('SELECT COUNT(*) FROM photos').fetchone()[0]
+  return conn.execute('SELECT COUNT(*) FROM photos WHERE rating = ?',
+                      (rating,)).fetchone()[0]
+
+def GetPicture(conn, rating, offset):
+  """
+  Return the (path, mtime, rating) of the picture at the specified offset within
+  the pictures with the specified rating, or all pictures if rating is None.
+  """
+  if rating is None:
+    return conn.execute('SELECT path, mtime, rating FROM photos '
+                        'LIMIT 1 OFFSET ?', (offset,)).fetchone()
+  return conn.execute('SELECT path, mtime, rating FROM photos WHERE rating = ? '
+                      'ORDER BY path LIMIT 1 OFFSET ?',
+                      (rating, offset)).fetchone()
 
-    rating_tag = 18246
+def LoadPictures(conn, rating=None):
+  """
+  Return a list of (path, mtime, rating) tuples for the pictures with the
+  specified rating, or all pictures if rating is None.
+  """
+  if rating is None:
+    return conn.execute('SELECT path, mtime, rating FROM photos').fetchall()
+  return conn.execute('SELECT path, mtime, rating FROM photos WHERE rating = ?',
+                      (rating,)).fetchall()
+
+def ReadTextDatabase(text_path):
+  """
+  Read a UTF-16 tab-separated database of path, mtime, and rating and return it
+  as a dictionary of path: (mtime, rating).
+  """
+  # 'utf-16' is not a sensible choice. I think I chose it because C# defaults
+  # to that encoding and I have some image processing tools written in C#.
+  database = {}
+  for path, mtime, rating in utf16_database.ReadRecords(text_path):
+    database[path] = (float(mtime), int(rating))
+  return database
 
-    new_database = {}
-    count = 0
-    updated = 0
-    for path in picture_list:
+def WriteTextDatabase(text_path, database):
+  """
+  Write a dictionary of path: (mtime, rating) in the UTF-16 tab-separated
+  format read by ReadTextDatabase.
+  """
+  output_list = []
+  for key, value in database.items():
+    output_list.append('%s\t%f\t%d' % (key, value[0], value[1]))
+  output_string = '\n'.join(output_list)
+  temp_path = text_path + '.tmp'
+  with open(temp_path, 'wb') as f:
+    f.write(output_string.encode('utf-16'))
+  os.replace(temp_path, text_path)
+
+def RebuildDatabase(conn, picture_list, jobs, verbose):
+  """
+  Bring the database in line with picture_list, reading the ratings of any
+  photos that are new or whose modification time has changed. Photos whose
+  rating can't be read are left out.
+  """
+  old_database = LoadDatabase(conn)
+  if verbose:
+    print('Updating database from %d to %d pictures.' % (len(old_database), len(picture_list)))
+
+  # Gather the modification times first so that the stale files can be handed
+  # to ScanRatings as a batch.
+  with instrumentation.Phase('stat'):
+    mtimes = [os.path.getmtime(path) for path in picture_list]
+    stale = [path for path, mtime in zip(picture_list, mtimes)
+             if path not in old_database or old_database[path][0] != mtime]
+
+  new_database = {}
+  count = 0
+  updated = 0
+  # Closing the generator shuts down ScanRatings' process pool, so that the
+  # workers' CPU time is counted in this phase.
+  with instrumentation.Phase('ratings'), \
+       contextlib.closing(ScanRatings(stale, jobs)) as ratings:
+    for path, mtime in zip(picture_list, mtimes):
       count += 1
       if int(count % 5000) == 0:
         print('%d out of %d, %s.' % (count, len(picture_list), path))
-      mtime = os.path.getmtime(path)
       if path in old_database and old_database[path][0] == mtime:
         new_database[path] = old_database[path]
       else:
         updated += 1
-        with Image.open(path) as img:
-          img_exif = img.getexif()
-          rating = img_exif.get(rating_tag, 0)
+        rating, error = next(ratings)
+        if error:
+          # Leave the photo out so that the next rebuild tries again, rather
+          # than recording a rating of zero until the file changes.
+          print('Failed to read rating from %s - %s' % (path, error))
+          continue
         new_database[path] = (mtime, rating)
-    if updated > 0:
-      print('Updated %d entries.' % updated)
-    if new_database != old_database:
-      print('Writing updated database.')
-      output_list = []
-      for key, value in new_database.items():
-        output_list.append('%s\t%f\t%d' % (key, value[0], value[1]))
-      output_string = '\n'.join(output_list)
-      with open(database_path, 'wb') as f:
-        f.write(output_string.encode('utf-16'))
-  else:
-    new_database = old_database
-  # Make sure we don't reference old_database anymore
-  del old_database
+    instrumentation.Count('files', updated)
+  if updated > 0:
+    print('Updated %d entries.' % updated)
+  if new_database != old_database:
+    print('Writing updated database.')
+    with instrumentation.Phase('write'):
+      UpdateDatabase(conn, old_database, new_database)
 
-  # Filter to just the 5-star photos.
-  if args.showall:
-    filtered = list(new_database.keys())
-  else:
-    filtered = [key for key in new_database.keys() if new_database[key][1] == 5]
-  if verbose:
-    print('Filtered from %d to %d pictures.' % (len(new_database), len(filtered)))
+def DatabaseMatches(conn, picture_list):
+  """
+  Return True if the database holds exactly the paths in picture_list.
+  """
+  paths = set(row[0] for row in conn.execute('SELECT path FROM photos'))
+  return paths == set(picture_list)
 
-  while True:
-    # Select a random line.
-    path = random.choice(filtered)
-    # Try again if the photo doesn't exist for some reason.
-    if not os.path.exists(path):
-      continue
-    # Try again if the file is a video.
-    extension = os.path.splitext(path)[1].lower()
-    if extension in ['.mp4', '.mov', '.wmv']:
-      continue
+def IsDisplayable(path):
+  """
+  Return True if path still exists and is not a video.
+  """
+  # Try again if the photo doesn't exist for some reason.
+  if not os.path.exists(path):
+    return False
+  # Try again if the file is a video.
+  extension = os.path.splitext(path)[1].lower()
+  return extension not in ['.mp4', '.mov', '.wmv']
+
+def RecordHistory(path, mtime, rating):
+  """
+  Record information about the displayed photo.
+  """
+  history = os.path.join(database_dir, 'WallpaperPhotoHistory.txt')
+  with open(history, 'a') as f:
+    f.write('%s\t%f\t%d\n' % (path, mtime, rating))
 
+def LogError(e):
+  """
+  Append a time-stamped description of an exception to WallpaperError.txt.
+  """
+  with open(os.path.join(database_dir, 'WallpaperError.txt'), 'a') as f:
+    date_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    message = 'Exception caught at %s: %s\n' % (date_time, e)
+    f.write(message)
+    print(message)
+
+class WallpaperBackend:
+  """
+  Interface for the mechanism that actually displays the selected photo.
+  """
+  def SetWallpaper(self, path):
+    raise NotImplementedError()
+
+class WindowsWallpaperBackend(WallpaperBackend):
+  """
+  Sets the Windows desktop wallpaper.
+  """
+  def SetWallpaper(self, path):
     # Magic incantation to set the wallpaper.
     SPI_SETDESKWALLPAPER = 20
     ctypes.windll.user32.SystemParametersInfoW(SPI_SETDESKWALLPAPER, 0, path, 2)
-    break
 
-  # Record information about the displayed photo.
-  history = os.path.join(database_dir, 'WallpaperPhotoHistory.txt')
-  with open(history, 'a') as f:
-    f.write('%s\t%f\t%d\n' % (path, new_database[path][0], new_database[path][1]))
+class FileWallpaperBackend(WallpaperBackend):
+  """
+  Writes the path of the selected photo to a file instead of displaying it. This
+  allows the selection logic to be exercised on non-Windows systems.
+  """
+  def __init__(self, output_path):
+    self.output_path = output_path
+
+  def SetWallpaper(self, path):
+    temp_path = self.output_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+      f.write(path + '\n')
+    os.replace(temp_path, self.output_path)
+
+def GetScreenSize():
+  """
+  Return the (width, height) of the primary monitor, or a typical size if it
+  can't be determined.
+  """
+  try:
+    SM_CXSCREEN = 0
+    SM_CYSCREEN = 1
+    user32 = ctypes.windll.user32
+    # Without this GetSystemMetrics returns the scaled size on HiDPI monitors
+    # and the cached pictures would be too small.
+    user32.SetProcessDPIAware()
+    return user32.GetSystemMetrics(SM_CXSCREEN), user32.GetSystemMetrics(SM_CYSCREEN)
+  except AttributeError:
+    return 1920, 1080
+
+class WallpaperCache:
+  """
+  A directory of photos pre-scaled to cover the screen, keyed by the original
+  path and mtime. New files are given an mtime of unshown_mtime, and the mtime
+  is set to the current time when a file is displayed. Only files that have
+  been displayed are evicted, least recently displayed first, so that scaling
+  work is never thrown away unused.
+  """
+  unshown_mtime = 1
+
+  def __init__(self, cache_dir, max_size, screen_size):
+    self.cache_dir = cache_dir
+    self.max_size = max_size
+    self.screen_size = screen_size
+    self.lock = threading.Lock()
+    os.makedirs(cache_dir, exist_ok=True)
+    sizes = [entry.stat().st_size for entry in os.scandir(cache_dir)
+             if entry.name.endswith('.jpg')]
+    self.total_size = sum(sizes)
+    self.count = len(sizes)
+
+  def CachePath(self, path, mtime):
+    key = hashlib.sha1(('%s\t%f' % (path, mtime)).encode('utf-8')).hexdigest()
+    return os.path.join(self.cache_dir, key + '.jpg')
+
+  def EstimateEntrySize(self):
+    """
+    Return the expected size of the next cached file, which is the average of
+    the current files or, for an empty cache, about three bits per pixel.
+    """
+    if self.count:
+      return self.total_size / self.count
+    width, height = self.screen_size
+    return width * height * 3 / 8
+
+  def IsFull(self):
+    """
+    Return True if another file probably wouldn't fit in the budget.
+    """
+    return self.total_size + self.EstimateEntrySize() > self.max_size
+
+  def Lookup(self, path, mtime):
+    """
+    Return the path of the cached copy of the photo, or None if there isn't one.
+    """
+    cache_path = self.CachePath(path, mtime)
+    try:
+      os.utime(cache_path)
+    except OSError:
+      return None
+    return cache_path
+
+  def Add(self, path, mtime):
+    """
+    Create a scaled copy of the photo in the cache, marked as not yet shown.
+    """
+    # To make this available you need to install Pillow with this command:
+    # pip3 install pillow
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = 300000000
+    cache_path = self.CachePath(path, mtime)
+    width, height = self.screen_size
+    with Image.open(path) as img:
+      # draft() lets the JPEG decoder do most of the scaling by decoding at a
+      # reduced size, which is much faster than decoding the whole image.
+      img.draft('RGB', (width, height))
+      img = ImageOps.exif_transpose(img)
+      # Scale so that the image covers the screen, since that is how the
+      # wallpaper will be displayed. Never scale up.
+      scale = max(width / img.width, height / img.height)
+      if scale < 1:
+        img = img.resize((max(1, int(img.width * scale + 0.5)),
+                          max(1, int(img.height * scale + 0.5))),
+                         Image.LANCZOS)
+      temp_path = cache_path + '.tmp'
+      img.convert('RGB').save(temp_path, 'JPEG', quality=90)
+    os.utime(temp_path, (self.unshown_mtime, self.unshown_mtime))
+    os.replace(temp_path, cache_path)
+    with self.lock:
+      self.total_size += os.path.getsize(cache_path)
+      self.count += 1
+    return cache_path
+
+  def Remove(self, cache_path):
+    size = os.path.getsize(cache_path)
+    os.remove(cache_path)
+    with self.lock:
+      self.total_size -= size
+      self.count -= 1
+
+  def Evict(self, pictures=None):
+    """
+    Delete the least recently displayed files until there is room for another
+    file. Files that haven't been displayed yet are kept, unless pictures, a
+    list of (path, mtime, rating) tuples, is passed and they aren't for one of
+    them. Those are for photos that have changed, been deleted, or are no
+    longer eligible, so they would never be displayed or evicted otherwise.
+    """
+    entries = [(entry.stat().st_mtime, entry.path)
+               for entry in os.scandir(self.cache_dir)
+               if entry.name.endswith('.jpg')]
+    if pictures is not None:
+      current = set(self.CachePath(path, mtime) for path, mtime, rating in
+                    pictures)
+      for mtime, cache_path in entries:
+        if cache_path not in current:
+          try:
+            self.Remove(cache_path)
+          except OSError as e:
+            print('Failure deleting %s - %s' % (cache_path, e))
+      entries = [entry for entry in entries if entry[1] in current]
+    if not self.IsFull():
+      return
+    entries.sort()
+    for mtime, cache_path in entries:
+      if not self.IsFull():
+        break
+      if mtime <= self.unshown_mtime:
+        continue
+      try:
+        self.Remove(cache_path)
+      except OSError as e:
+        print('Failure deleting %s - %s' % (cache_path, e))
+
+  def Fill(self, pictures, limit=None, stop=None):
+    """
+    Make room by evicting displayed and stale photos and then add uncached
+    photos from the list of (path, mtime, rating) tuples, in random order,
+    until the next one probably wouldn't fit, limit photos have been added, or
+    stop is set. Returns the number of photos added.
+    """
+    pictures = list(pictures)
+    self.Evict(pictures)
+    random.shuffle(pictures)
+    added = 0
+    for path, mtime, rating in pictures:
+      if self.IsFull() or (limit is not None and added >= limit):
+        break
+      if stop and stop.is_set():
+        break
+      if os.path.exists(self.CachePath(path, mtime)) or not IsDisplayable(path):
+        continue
+      try:
+        cache_path = self.Add(path, mtime)
+      except Exception as e:
+        print('Failed to cache %s - %s' % (path, e))
+        continue
+      # The estimate was wrong, so discard this photo rather than go over the
+      # budget, and stop because the next one probably won't fit either.
+      if self.total_size > self.max_size:
+        self.Remove(cache_path)
+        break
+      added += 1
+    return added
+
+class WallpaperDaemon:
+  """
+  Keeps the eligible photos in memory and rotates the wallpaper on a timer,
+  while a background thread polls the picture directories for changes and
+  updates the database and the in-memory list when they are found.
+  """
+  def __init__(self, database_path, index_path, directories, backend, cache,
+               filter_rating, jobs, interval, poll_interval, verbose):
+    self.database_path = database_path
+    self.index_path = index_path
+    self.directories = directories
+    self.backend = backend
+    self.cache = cache
+    self.filter_rating = filter_rating
+    self.jobs = jobs
+    self.interval = interval
+    self.poll_interval = poll_interval
+    self.verbose = verbose
+    self.index = LoadDirectoryIndex(index_path)
+    self.pictures = []
+    self.lock = threading.Lock()
+    self.stop = threading.Event()
+
+  def Refresh(self, force=False):
+    """
+    Rescan the picture directories and, if anything changed, update the
+    database and reload the list of eligible photos.
+    """
+    picture_list, index = ScanPictureDirectories(self.directories, self.index)
+    if index == self.index and not force:
+      return
+    # SQLite connections can't be shared between threads so each refresh opens
+    # its own.
+    conn = OpenDatabase(self.database_path)
+    try:
+      if CountPictures(conn) == 0 or not DatabaseMatches(conn, picture_list):
+        with instrumentation.Phase('rebuild'):
+          RebuildDatabase(conn, picture_list, self.jobs, self.verbose)
+      pictures = LoadPictures(conn, self.filter_rating)
+    finally:
+      conn.close()
+    if index != self.index:
+      SaveDirectoryIndex(self.index_path, index)
+      self.index = index
+    with self.lock:
+      self.pictures = pictures
+    if self.verbose:
+      print('Refreshed index, %d eligible pictures.' % len(pictures))
+
+  def Rotate(self):
+    """
+    Display a randomly selected eligible photo.
+    """
+    with self.lock:
+      pictures = self.pictures
+    # Skip photos that have disappeared since the last refresh, but give up
+    # rather than spin if none of them are usable.
+    for attempt in range(100):
+      if not pictures:
+        break
+      path, mtime, rating = random.choice(pictures)
+      if IsDisplayable(path):
+        cache_path = self.cache.Lookup(path, mtime) if self.cache else None
+        self.backend.SetWallpaper(cache_path or path)
+        RecordHistory(path, mtime, rating)
+        if self.verbose:
+          print('Displaying %s%s.' % (path, ' (cached)' if cache_path else ''))
+        return
+    print('No pictures to choose from.')
+
+  def PollLoop(self):
+    while not self.stop.wait(self.poll_interval):
+      try:
+        self.Refresh()
+      except Exception as e:
+        LogError(e)
+
+  def FillLoop(self):
+    while not self.stop.is_set():
+      with self.lock:
+        pictures = self.pictures
+      try:
+        self.cache.Fill(pictures, stop=self.stop)
+      except Exception as e:
+        LogError(e)
+      if self.stop.wait(self.poll_interval):
+        break
+
+  def Run(self):
+    self.Refresh(force=True)
+    poller = threading.Thread(target=self.PollLoop, daemon=True)
+    poller.start()
+    if self.cache:
+      filler = threading.Thread(target=self.FillLoop, daemon=True)
+      filler.start()
+    try:
+      while True:
+        try:
+          self.Rotate()
+        except Exception as e:
+          LogError(e)
+        if self.stop.wait(self.interval):
+          break
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.stop.set()
+      poller.join()
+      if self.cache:
+        filler.join()
+
+def main():
+  # RecordHistory and LogError also write to database_dir, so --database-dir
+  # replaces the global.
+  global database_dir
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--showall', help='If specified then show all pictures '
+                      'instead of just five-star images',
+                      action='store_true')
+  parser.add_argument('--jobs', help='Number of processes to use when scanning '
+                      'photos for ratings. Zero means one per CPU.',
+                      type=int, default=1)
+  parser.add_argument('--import-text', help='Replace the contents of the '
+                      'database with those of WallpaperPhotoDatabase.txt.',
+                      action='store_true')
+  parser.add_argument('--export-text', help='Write the contents of the '
+                      'database to WallpaperPhotoDatabase.txt.',
+                      action='store_true')
+  parser.add_argument('--daemon', help='Keep running, changing the wallpaper '
+                      'every --interval seconds and polling for new pictures '
+                      'every --poll-interval seconds.',
+                      action='store_true')
+  parser.add_argument('--interval', help='Seconds between wallpaper changes '
+                      'in --daemon mode.', type=float, default=300)
+  parser.add_argument('--poll-interval', help='Seconds between checks for '
+                      'picture changes in --daemon mode.', type=float,
+                      default=60)
+  parser.add_argument('--wallpaper-file', help='Write the path of the selected '
+                      'picture to this file instead of setting the wallpaper.')
+  parser.add_argument('--cache-size', help='Size budget in MB for a cache of '
+                      'pictures pre-scaled to the screen size. Zero disables '
+                      'the cache.', type=float, default=0)
+  parser.add_argument('--cache-fill', help='Number of pictures to add to the '
+                      'cache per run when not in --daemon mode.', type=int,
+                      default=5)
+  parser.add_argument('--screen-size', help='Size to scale cached pictures to, '
+                      'as WIDTHxHEIGHT. Defaults to the primary monitor size.')
+  parser.add_argument('--database-dir', help='Directory for the database, '
+                      'cache, history and error log. Defaults to %s.' %
+                      database_dir)
+  parser.add_argument('--pictures', help='Directory of pictures to choose '
+                      'from. Can be specified multiple times. Defaults to the '
+                      'user and public Pictures directories.', action='append')
+  instrumentation.AddArguments(parser)
+  args = parser.parse_args()
+  instrumentation.Start('RandomWallpaper', args)
+  if args.database_dir:
+    database_dir = args.database_dir
+  jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+  if args.wallpaper_file:
+    backend = FileWallpaperBackend(args.wallpaper_file)
+  else:
+    backend = WindowsWallpaperBackend()
+  filter_rating = None if args.showall else 5
+  cache = None
+  if args.cache_size > 0:
+    if args.screen_size:
+      screen_size = tuple(int(x) for x in args.screen_size.lower().split('x'))
+    else:
+      screen_size = GetScreenSize()
+    cache = WallpaperCache(os.path.join(database_dir, 'WallpaperCache'),
+                           int(args.cache_size * 1e6), screen_size)
+
+  verbose = True
+  database_path = os.path.join(database_dir, 'WallpaperPhotoDatabase.sqlite')
+  text_database_path = os.path.join(database_dir, 'WallpaperPhotoDatabase.txt')
+  index_path = os.path.join(database_dir, 'WallpaperDirectoryIndex.json')
+  # Import the text database when the SQLite database is first created so that
+  # the existing ratings don't need to be scanned again.
+  import_text = args.import_text or not os.path.exists(database_path)
+  conn = OpenDatabase(database_path)
+  if import_text and os.path.exists(text_database_path):
+    if verbose:
+      print('Importing %s.' % text_database_path)
+    with instrumentation.Phase('import text'):
+      UpdateDatabase(conn, LoadDatabase(conn),
+                     ReadTextDatabase(text_database_path))
+
+  mypictures = os.path.expanduser(r'~\Pictures')
+  publicpictures = os.path.normpath(os.path.expanduser(r'~\..\public\Pictures'))
+  # Set this to the list of directories to be scanned.
+  directories = args.pictures or [mypictures, publicpictures]
+
+  if args.daemon:
+    conn.close()
+    daemon = WallpaperDaemon(database_path, index_path, directories, backend,
+                             cache, filter_rating, jobs, args.interval,
+                             args.poll_interval, verbose)
+    daemon.Run()
+    return
+
+  # Scanning the picture directories gives a reliable way to detect when new
+  # pictures appear, disappear, or are renamed. The directory index means that
+  # only changed directories are listed, but every directory is still stat'ed,
+  # which is not free on slow hard drives. Set detect_changes to True to get
+  # updates whenever the set of files changes.
+  detect_changes = True
+  if detect_changes:
+    with instrumentation.Phase('scan'):
+      old_index = LoadDirectoryIndex(index_path)
+      picture_list, index = ScanPictureDirectories(directories, old_index)
+      instrumentation.Count('files', len(picture_list))
+
+  # Recreate the database if it doesn't exist or if the set of files has
+  # changed. The index is only saved after the database has been updated, so if
+  # it is unchanged then the database must already match the file list.
+  rebuild = CountPictures(conn) == 0
+  if detect_changes and (index != old_index or import_text) and not rebuild:
+    with instrumentation.Phase('match'):
+      rebuild = not DatabaseMatches(conn, picture_list)
+  if rebuild:
+    with instrumentation.Phase('rebuild'):
+      if not detect_changes:
+        picture_list = GetPicturePaths(directories)
+      RebuildDatabase(conn, picture_list, jobs, verbose)
+  if detect_changes and index != old_index:
+    SaveDirectoryIndex(index_path, index)
+
+  if args.export_text:
+    if verbose:
+      print('Exporting %s.' % text_database_path)
+    with instrumentation.Phase('export text'):
+      WriteTextDatabase(text_database_path, LoadDatabase(conn))
+
+  with instrumentation.Phase('select'):
+    # Filter to just the 5-star photos.
+    filtered_count = CountPictures(conn, filter_rating)
+    if verbose:
+      print('Filtered from %d to %d pictures.' % (CountPictures(conn), filtered_count))
+    if filtered_count == 0:
+      raise Exception('No pictures to choose from.')
+
+    while True:
+      # Select a random row from the matching rows of the index.
+      path, mtime, rating = GetPicture(conn, filter_rating,
+                                       random.randrange(filtered_count))
+      if IsDisplayable(path):
+        break
+  with instrumentation.Phase('set wallpaper'):
+    cache_path = cache.Lookup(path, mtime) if cache else None
+    if verbose and cache_path:
+      print('Using cached copy of %s.' % path)
+    backend.SetWallpaper(cache_path or path)
+    RecordHistory(path, mtime, rating)
+
+  # Scale a few more photos for future runs. This happens after the wallpaper
+  # has been set so that it doesn't delay the change.
+  if cache:
+    with instrumentation.Phase('cache fill'):
+      # Cached files only go stale when the database changes, so the eligible
+      # photos are only loaded after a rebuild or when there is room to add
+      # some, keeping a run with a full cache down to reading one record.
+      pictures = LoadPictures(conn, filter_rating) if rebuild else None
+      cache.Evict(pictures)
+      added = 0
+      if not cache.IsFull():
+        if pictures is None:
+          pictures = LoadPictures(conn, filter_rating)
+        added = cache.Fill(pictures, limit=args.cache_fill)
+      instrumentation.Count('files', added)
+    if verbose:
+      print('Added %d pictures to the cache.' % added)
 
 
 if __name__ == '__main__':
@@ -182,11 +904,7 @@ if __name__ == '__main__':
   try:
     main()
   except Exception as e:
-    with open(os.path.join(database_dir, 'WallpaperError.txt'), 'a') as f:
-      date_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-      message = 'Exception caught at %s: %s\n' % (date_time, e)
-      f.write(message)
-      print(message)
+    LogError(e)
   elapsed = time.time() - start
   if verbose:
     print('%f s to do work.' % elapsed)
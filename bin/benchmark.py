@@ -0,0 +1,369 @@
+# Copyright 2021 Bruce Dawson. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""
+Benchmarks for RandomWallpaper.py, CopyPhotoSubset.py and trim_symbols.py that
+run against generated data instead of ~\Pictures, PhotoDatabase.txt and
+c:\symbols, so that they work on any machine, including Linux.
+
+For each scale this generates a tree of JPEGs with EXIF ratings, a UTF-16
+tab-separated photo database describing them, and a symbol cache with some
+.error files, and then times these phases:
+
+  wallpaper-scan     Listing the picture tree.
+  wallpaper-rebuild  Reading the ratings and writing the SQLite database.
+  wallpaper-select   Picking random five-star pictures from the database.
+  photo-index        Building the word index of the photo database.
+  photo-select       Finding the database lines that match a word.
+  photo-copy         Copying the matching photos.
+  symbol-scan        Scanning the symbol cache.
+  symbol-trim        Deleting all but the newest two versions of each binary.
+
+Each phase runs in its own process so that its peak memory can be measured.
+Throughput and peak memory are printed and compared with a baseline that was
+saved by an earlier run with --save-baseline. Sample usage:
+
+  python3 benchmark.py --scales 1000,10000 --save-baseline
+  ... make changes ...
+  python3 benchmark.py --scales 1000,10000
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import utf16_database
+
+phases = ['wallpaper-scan', 'wallpaper-rebuild', 'wallpaper-select',
+          'photo-index', 'photo-select', 'photo-copy',
+          'symbol-scan', 'symbol-trim']
+
+default_baseline_path = os.path.join(os.path.expanduser('~'),
+                                     'tool_benchmark_baseline.json')
+
+# Words for the photo descriptions, and the word that is searched for, which
+# is added to one line in ten.
+words = ['beach', 'birthday', 'bridge', 'cat', 'city', 'dog', 'family',
+         'forest', 'garden', 'harbour', 'hike', 'lake', 'mountain', 'night',
+         'party', 'rain', 'river', 'snow', 'sunrise', 'trail']
+needle = 'sunset'
+
+# Photos per directory in the generated tree.
+photos_per_dir = 100
+
+def MakeJpeg(rating, size):
+  """
+  Return the bytes of a minimal JPEG file of about size bytes whose EXIF IFD0
+  contains the specified rating. There is no image data, which doesn't matter
+  to the header parser, and the file is padded with a comment segment.
+  """
+  ifd = struct.pack('<HHHIHHI', 1, 18246, 3, 1, rating, 0, 0)
+  tiff = b'II' + struct.pack('<HI', 42, 8) + ifd
+  app1 = b'Exif\0\0' + tiff
+  data = [b'\xff\xd8', b'\xff\xe1', struct.pack('>H', len(app1) + 2), app1]
+  padding = size - len(app1) - 8
+  while padding > 0:
+    length = min(padding, 65533)
+    data += [b'\xff\xfe', struct.pack('>H', length + 2), b'\0' * length]
+    padding -= length + 4
+  data.append(b'\xff\xd9')
+  return b''.join(data)
+
+def MakePhotoTree(root, count, size, seed):
+  """
+  Write count JPEGs of about size bytes to root, photos_per_dir per directory,
+  with about a fifth of them rated five stars. Returns their paths.
+  """
+  rand = random.Random(seed)
+  paths = []
+  for index in range(count):
+    dir = os.path.join(root, '%d' % (2000 + index // 10000),
+                       '%03d' % (index // photos_per_dir % 100))
+    if index % photos_per_dir == 0:
+      os.makedirs(dir, exist_ok=True)
+    path = os.path.join(dir, 'IMG_%06d.jpg' % index)
+    rating = 5 if rand.random() < 0.2 else rand.randrange(5)
+    with open(path, 'wb') as f:
+      f.write(MakeJpeg(rating, size))
+    paths.append(path)
+  return paths
+
+def MakePhotoDatabase(database_path, photo_paths, seed):
+  """
+  Write a UTF-16 tab-separated database, in the format that CopyPhotoSubset.py
+  reads, with a line for each photo giving its path, a date and a description
+  of three words.
+  """
+  rand = random.Random(seed)
+  with open(database_path, 'w', encoding='utf-16', newline='\r\n') as f:
+    for index, path in enumerate(photo_paths):
+      description = ' '.join(rand.sample(words, 3))
+      if rand.random() < 0.1:
+        description += ' ' + needle
+      f.write('%s\t2021-%02d-%02d\t%s\n' % (path, index % 12 + 1,
+                                             index % 28 + 1, description))
+
+def MakeSymbolCache(root, guid_dir_count, error_fraction, seed):
+  """
+  Write a symbol cache with guid_dir_count GUID directories spread over
+  binaries that have one to ten versions each. A fraction of the GUID
+  directories also contain a .error file.
+  """
+  rand = random.Random(seed)
+  extensions = ['.dll.pdb', '.exe.pdb', '.dll', '.exe']
+  made = 0
+  binary = 0
+  while made < guid_dir_count:
+    name = 'binary%d%s' % (binary, extensions[binary % len(extensions)])
+    binary += 1
+    versions = min(rand.randint(1, 10), guid_dir_count - made)
+    for version in range(versions):
+      dir = os.path.join(root, name, '%032X%d' % (rand.getrandbits(128),
+                                                  version))
+      os.makedirs(dir)
+      with open(os.path.join(dir, name), 'wb') as f:
+        f.write(b'\0' * rand.randint(1000, 20000))
+      if rand.random() < error_fraction:
+        with open(os.path.join(dir, name + '.error'), 'w') as f:
+          f.write('Error downloading %s\n' % name)
+      # Give the versions distinct ages so that the newest are well defined.
+      mtime = time.time() - (versions - version) * 86400
+      os.utime(dir, (mtime, mtime))
+    made += versions
+
+def Generate(work_dir, scale, photo_size, seed):
+  """
+  Generate all of the data for one scale in work_dir.
+  """
+  photo_paths = MakePhotoTree(os.path.join(work_dir, 'Pictures'), scale,
+                              photo_size, seed)
+  MakePhotoDatabase(os.path.join(work_dir, 'PhotoDatabase.txt'), photo_paths,
+                    seed)
+  MakeSymbolCache(os.path.join(work_dir, 'symbols'), scale, 0.1, seed)
+  os.makedirs(os.path.join(work_dir, 'Documents'), exist_ok=True)
+
+def RunPhase(phase, work_dir):
+  """
+  Run one phase against the data in work_dir and return the time it took, the
+  number of items that it processed and the number of bytes it copied or
+  deleted. Setup that isn't part of the phase is done before timing starts.
+  """
+  # The tools live next to this script. They are imported here so that only
+  # the phase processes pay for them.
+  import CopyPhotoSubset
+  import RandomWallpaper
+  import trim_symbols
+
+  pictures_dir = os.path.join(work_dir, 'Pictures')
+  database_path = os.path.join(work_dir, 'PhotoDatabase.txt')
+  index_path = os.path.join(work_dir, 'PhotoDatabase.index.sqlite')
+  symbols_dir = os.path.join(work_dir, 'symbols')
+  # Keep RandomWallpaper.py's history and error logs out of ~\Documents.
+  RandomWallpaper.database_dir = os.path.join(work_dir, 'Documents')
+  wallpaper_database_path = os.path.join(RandomWallpaper.database_dir,
+                                         'WallpaperPhotoDatabase.sqlite')
+  copy_bytes = 0
+
+  if phase == 'wallpaper-scan':
+    start = time.perf_counter()
+    picture_list, index = RandomWallpaper.ScanPictureDirectories([pictures_dir],
+                                                                 {})
+    items = len(picture_list)
+  elif phase == 'wallpaper-rebuild':
+    picture_list, index = RandomWallpaper.ScanPictureDirectories([pictures_dir],
+                                                                 {})
+    start = time.perf_counter()
+    conn = RandomWallpaper.OpenDatabase(wallpaper_database_path)
+    RandomWallpaper.RebuildDatabase(conn, picture_list, 1, False)
+    conn.close()
+    items = len(picture_list)
+  elif phase == 'wallpaper-select':
+    # Fill the database first if wallpaper-rebuild wasn't run.
+    conn = RandomWallpaper.OpenDatabase(wallpaper_database_path)
+    if RandomWallpaper.CountPictures(conn, 5) == 0:
+      picture_list, index = RandomWallpaper.ScanPictureDirectories(
+          [pictures_dir], {})
+      RandomWallpaper.RebuildDatabase(conn, picture_list, 1, False)
+    conn.close()
+    rand = random.Random(0)
+    start = time.perf_counter()
+    conn = RandomWallpaper.OpenDatabase(wallpaper_database_path)
+    count = RandomWallpaper.CountPictures(conn, 5)
+    items = 1000
+    for selection in range(items):
+      RandomWallpaper.GetPicture(conn, 5, rand.randrange(count))
+    conn.close()
+  elif phase == 'photo-index':
+    items = sum(1 for line in utf16_database.ReadLines(database_path))
+    start = time.perf_counter()
+    CopyPhotoSubset.BuildIndex(database_path, index_path)
+  elif phase == 'photo-select':
+    # Build the index first if photo-index wasn't run.
+    conn, meta = CopyPhotoSubset.OpenIndex(database_path, index_path)
+    conn.close()
+    start = time.perf_counter()
+    items = len(list(CopyPhotoSubset.FindLines(database_path, [needle], False,
+                                               False)))
+  elif phase == 'photo-copy':
+    dest = os.path.join(work_dir, 'copy')
+    copies = []
+    for line in CopyPhotoSubset.FindLines(database_path, [needle], False,
+                                          False):
+      path = line.split('\t')[0]
+      copies.append((path, os.path.join(dest, os.path.relpath(path,
+                                                              pictures_dir))))
+      copy_bytes += os.path.getsize(path)
+    os.makedirs(dest, exist_ok=True)
+    start = time.perf_counter()
+    CopyPhotoSubset.CopyFiles(copies, os.path.join(
+        dest, 'CopyPhotoSubsetManifest.txt'), 4)
+    items = len(copies)
+  elif phase == 'symbol-scan':
+    start = time.perf_counter()
+    guid_dirs, inventory = trim_symbols.ScanCache(symbols_dir, 8)
+    items = len(guid_dirs)
+  elif phase == 'symbol-trim':
+    guid_dirs, inventory = trim_symbols.ScanCache(symbols_dir, 8)
+    start = time.perf_counter()
+    plan = trim_symbols.PlanKeepNewest(guid_dirs)
+    items = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+      for count, size, failed in executor.map(trim_symbols.ExecuteActions,
+                                              plan):
+        items += count
+        copy_bytes += size
+  else:
+    raise ValueError('Unknown phase %s' % phase)
+  return time.perf_counter() - start, items, copy_bytes
+
+def RunPhaseProcess(phase, work_dir):
+  """
+  Run a phase in a child process and return its result, with the peak memory
+  of the process added.
+  """
+  process = subprocess.run([sys.executable, os.path.abspath(__file__),
+                            '--run-phase', phase, '--work-dir', work_dir],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True)
+  if process.returncode:
+    raise Exception('%s failed:\n%s' % (phase, process.stderr))
+  # The tools print progress, so the result is the last line.
+  return json.loads(process.stdout.splitlines()[-1])
+
+def FormatRatio(value, baseline):
+  if not value or not baseline:
+    return ''
+  return '%5.2fx' % (value / baseline)
+
+def PrintResults(results, baseline):
+  """
+  Print a table of the results, with the throughput and peak memory relative
+  to the baseline when it has the same phase and scale. Higher throughput and
+  lower memory ratios are better.
+  """
+  print('%-18s %7s %9s %11s %9s %8s %8s %8s' %
+        ('Phase', 'Scale', 'Seconds', 'Items/s', 'MB/s', 'Peak MB',
+         'vs items', 'vs peak'))
+  for key, result in results.items():
+    phase, scale = key.split('@')
+    elapsed = max(result['seconds'], 1e-9)
+    rate = result['items'] / elapsed
+    mb_rate = '%9.1f' % (result['bytes'] / 1e6 / elapsed) if result['bytes'] \
+        else ' ' * 9
+    peak = result['peak_memory']
+    old = baseline.get(key)
+    old_rate = old['items'] / max(old['seconds'], 1e-9) if old else None
+    print('%-18s %7s %9.3f %11.1f %s %8s %8s %8s' %
+          (phase, scale, elapsed, rate, mb_rate,
+           '%8.1f' % (peak / 1e6) if peak else '',
+           FormatRatio(rate, old_rate),
+           FormatRatio(peak, old['peak_memory'] if old else None)))
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scales', help='Comma separated numbers of photos, '
+                      'database lines and GUID directories to generate.',
+                      default='1000,10000')
+  parser.add_argument('--phases', help='Comma separated phases to run. '
+                      'Defaults to all of them.', default=','.join(phases))
+  parser.add_argument('--photo-size', help='Size of each generated photo in '
+                      'bytes.', type=int, default=100000)
+  parser.add_argument('--seed', help='Random seed for the generated data.',
+                      type=int, default=0)
+  parser.add_argument('--baseline', help='Results to compare with. Defaults '
+                      'to %(default)s.', default=default_baseline_path)
+  parser.add_argument('--save-baseline', help='Save the results as the new '
+                      'baseline.', action='store_true')
+  parser.add_argument('--work-dir', help='Directory for the generated data. '
+                      'Defaults to a temporary directory that is deleted '
+                      'afterwards.')
+  parser.add_argument('--run-phase', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run_phase:
+    seconds, items, copy_bytes = RunPhase(args.run_phase, args.work_dir)
+    print(json.dumps({'seconds': seconds, 'items': items, 'bytes': copy_bytes,
+                      'peak_memory': utf16_database.GetPeakMemory()}))
+    return 0
+
+  selected = args.phases.split(',')
+  for phase in selected:
+    if phase not in phases:
+      print('Unknown phase %s. Phases are: %s' % (phase, ', '.join(phases)))
+      return 1
+  try:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+  except (OSError, ValueError):
+    baseline = {}
+
+  work_root = args.work_dir or tempfile.mkdtemp(prefix='benchmark')
+  results = {}
+  try:
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+      work_dir = os.path.join(work_root, str(scale))
+      if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+      start = time.perf_counter()
+      Generate(work_dir, scale, args.photo_size, args.seed)
+      print('Generated data for scale %d in %1.1f s.' %
+            (scale, time.perf_counter() - start))
+      # The phases are run in order because later ones use the output of
+      # earlier ones, such as the wallpaper database and the photo index.
+      for phase in phases:
+        if phase in selected:
+          results['%s@%d' % (phase, scale)] = RunPhaseProcess(phase, work_dir)
+      shutil.rmtree(work_dir)
+  finally:
+    if not args.work_dir:
+      shutil.rmtree(work_root, ignore_errors=True)
+
+  PrintResults(results, baseline)
+  if args.save_baseline:
+    baseline.update(results)
+    with open(args.baseline, 'w') as f:
+      json.dump(baseline, f, indent=2)
+    print('Saved baseline to %s.' % args.baseline)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
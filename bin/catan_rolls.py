@@ -17,37 +17,350 @@ Summarize Catan roll information from colonist.io roll history. The expected use
 is to select-all/copy the roll history then run catan_rolls.bat which uses
 fromclip.exe (not yet released) to pipe the clipboard data to this Python
 script.
+
+Saved roll histories can also be accumulated across many games. --ingest parses
+every file in a directory (in parallel) and appends the rolls from any new or
+changed files to an SQLite store, and --query then summarizes all of the stored
+games without reparsing the logs:
+
+  python3 catan_rolls.py --ingest saved_games
+  python3 catan_rolls.py --query histogram
+  python3 catan_rolls.py --query sevens
+
+To tell a suspicious run of luck from normal variance, --analyze compares a
+game's rolls with the theoretical 2d6 distribution using a chi-square test, and
+simulates (with numpy) a million games of the same length to get p-values for
+the longest streak of the same total, the longest stretch without a seven, and
+each player's count of sevens. Use --seed to make the simulation reproducible.
 """
 
 from __future__ import print_function
 
+import argparse
+import concurrent.futures
 import fileinput
+import math
+import os
+import re
+import sqlite3
+
+# Matches lines like "GuestFodor rolled: dice_2 dice_6". Player names may
+# contain spaces.
+roll_pattern = re.compile(r'^\s*(.*?\S)\s+rolled:?\s+dice_(\d)\s+dice_(\d)\s*$')
+
+def CleanName(person):
+  """
+  Strip the noise from a colonist.io player name.
+  """
+  # Strip off the noisy 'Guest' prefix for cleaner output.
+  if person.startswith('Guest'):
+    person = person[len('Guest'):]
+  # Strip off the #nnnn suffix for cleaner output.
+  return person.split('#')[0]
+
+def ParseRolls(lines):
+  """
+  Return a list of (person, dice1, dice2) tuples for the rolls in lines.
+  """
+  rolls = []
+  for line in lines:
+    match = roll_pattern.match(line)
+    if match:
+      rolls.append((CleanName(match.group(1)), int(match.group(2)),
+                    int(match.group(3))))
+  return rolls
+
+def ParseFile(path):
+  """
+  Return the rolls from a saved roll history. This runs in worker processes
+  when ingesting.
+  """
+  with open(path, 'r', encoding='utf-8', errors='replace') as f:
+    return ParseRolls(f)
+
+# The probability of each total from 2 to 12 when rolling two fair dice.
+two_dice_probabilities = [(6 - abs(total - 7)) / 36.0 for total in range(2, 13)]
+
+def ChiSquareSurvival(x, df):
+  """
+  Return the probability that a chi-square distributed value with df (an
+  integer) degrees of freedom is at least x. This is the regularized upper
+  incomplete gamma function, which has a closed form for integer and
+  half-integer parameters.
+  """
+  y = x / 2.0
+  if df % 2 == 0:
+    term = math.exp(-y)
+    total = term
+    for i in range(1, df // 2):
+      term *= y / i
+      total += term
+    return total
+  total = math.erfc(math.sqrt(y))
+  term = math.exp(-y) * math.sqrt(y) / math.gamma(1.5)
+  for i in range(df // 2):
+    total += term
+    term *= y / (i + 1.5)
+  return total
+
+def LongestRuns(totals):
+  """
+  Return the length of the longest run of identical totals, and the longest run
+  of totals other than seven, in a sequence of totals.
+  """
+  longest_same = longest_no_seven = 0
+  same = no_seven = 0
+  previous = None
+  for total in totals:
+    same = same + 1 if total == previous else 1
+    no_seven = no_seven + 1 if total != 7 else 0
+    longest_same = max(longest_same, same)
+    longest_no_seven = max(longest_no_seven, no_seven)
+    previous = total
+  return longest_same, longest_no_seven
+
+def LongestTrueRuns(matrix):
+  """
+  Return the length of the longest run of True values in each row of a
+  two-dimensional boolean numpy array. The rows are flattened together, each
+  preceded by a False, and a trailing False is added, so that the values change
+  exactly at the start and end of every run, alternately.
+  """
+  import numpy
+  rows, columns = matrix.shape
+  flat = numpy.zeros(rows * (columns + 1) + 1, dtype=bool)
+  flat[:-1].reshape(rows, columns + 1)[:, 1:] = matrix
+  changes = numpy.flatnonzero(flat[1:] != flat[:-1])
+  lengths = changes[1::2] - changes[0::2]
+  longest = numpy.zeros(rows, dtype=numpy.int32)
+  if len(lengths):
+    # The runs are in row order, so reduceat over the index where each row's
+    # runs begin gives the longest run of every row that has any.
+    run_rows = changes[0::2] // (columns + 1)
+    firsts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(run_rows)) +
+                                1))
+    longest[run_rows[firsts]] = numpy.maximum.reduceat(lengths, firsts)
+  return longest
+
+def SimulateLongestRuns(rng, roll_count, game_count, batch_size=20000):
+  """
+  Simulate game_count games of roll_count rolls and return arrays of the
+  LongestRuns results for each game. The games are simulated in batches of
+  batch_size games to limit memory use.
+  """
+  import numpy
+  longest_same = numpy.empty(game_count, dtype=numpy.int32)
+  longest_no_seven = numpy.empty(game_count, dtype=numpy.int32)
+  for start in range(0, game_count, batch_size):
+    count = min(batch_size, game_count - start)
+    totals = (rng.integers(1, 7, size=(count, roll_count), dtype=numpy.int8) +
+              rng.integers(1, 7, size=(count, roll_count), dtype=numpy.int8))
+    # A run of n identical totals is a run of n - 1 repeats.
+    repeats = totals[:, 1:] == totals[:, :-1]
+    longest_same[start:start + count] = (LongestTrueRuns(repeats) +
+                                         (1 if roll_count else 0))
+    longest_no_seven[start:start + count] = LongestTrueRuns(totals != 7)
+  return longest_same, longest_no_seven
+
+def Analyze(rolls, game_count, seed):
+  """
+  Print statistical tests of whether the list of (person, dice1, dice2) rolls
+  looks like it came from fair dice.
+  """
+  # To make this available you need to install numpy with this command:
+  # pip3 install numpy
+  import numpy
+  totals = [dice1 + dice2 for person, dice1, dice2 in rolls]
+  if len(totals) < 2:
+    print('Not enough rolls to analyze.')
+    return
+
+  histograms = [0] * 11
+  for total in totals:
+    histograms[total - 2] += 1
+  expected = [len(totals) * p for p in two_dice_probabilities]
+  chi_square = sum((observed - e) ** 2 / e for observed, e in
+                   zip(histograms, expected))
+  print('Chi-square vs. fair dice is %1.3f with 10 degrees of freedom, '
+        'p = %1.4f.' % (chi_square, ChiSquareSurvival(chi_square, 10)))
+  if min(expected) < 5:
+    print('Note: with fewer than 180 rolls some expected counts are below five '
+          'so the chi-square test is only approximate.')
 
-# Zero-based is for C/C++, one-based is for Fortran, but two-based is for dice
-# games. Subtract two when storing data, add two when retrieving it.
-histograms = [0] * 11
-
-sevens = {}
-
-for line in fileinput.input():
-  if line.count("rolled") > 0:
-    person, rolled, dice1, dice2 = line.split()
-    # Strip off the noisy 'Guest' prefix for cleaner output.
-    if person.startswith('Guest'):
-      person = person[len('Guest'):]
-    # Strip off the #nnnn suffix for cleaner output.
-    person = person.split('#')[0]
-    roll = int(dice1[-1]) + int(dice2[-1])
+  rng = numpy.random.default_rng(seed)
+  longest_same, longest_no_seven = LongestRuns(totals)
+  sim_same, sim_no_seven = SimulateLongestRuns(rng, len(totals), game_count)
+  print('Longest streak of the same total is %d rolls, p = %1.4f.' %
+        (longest_same, numpy.mean(sim_same >= longest_same)))
+  print('Longest stretch without a seven is %d rolls, p = %1.4f.' %
+        (longest_no_seven, numpy.mean(sim_no_seven >= longest_no_seven)))
+
+  players = sorted(set(person for person, dice1, dice2 in rolls))
+  roll_counts = numpy.array([sum(1 for roll in rolls if roll[0] == person)
+                             for person in players])
+  sevens = numpy.array([sum(1 for roll in rolls if roll[0] == person and
+                            roll[1] + roll[2] == 7) for person in players])
+  # Each player's count of sevens is binomially distributed so it can be
+  # simulated directly.
+  sim_sevens = rng.binomial(roll_counts, 1 / 6.0,
+                            size=(game_count, len(players)))
+  for i, person in enumerate(players):
+    print('%s rolled %d sevens in %d rolls (%1.1f expected), p = %1.4f.' %
+          (person, sevens[i], roll_counts[i], roll_counts[i] / 6.0,
+           numpy.mean(sim_sevens[:, i] >= sevens[i])))
+  # Looking at every player makes it more likely that one of them has an
+  # unusual count, so also check the largest excess against the simulation.
+  excess = sevens - roll_counts / 6.0
+  sim_excess = (sim_sevens - roll_counts / 6.0).max(axis=1)
+  print('Largest excess of sevens is %1.1f by %s, p = %1.4f (%d simulated '
+        'games).' % (excess.max(), players[int(excess.argmax())],
+                     numpy.mean(sim_excess >= excess.max() - 1e-9),
+                     game_count))
+
+def OpenStore(store_path):
+  """
+  Open the SQLite roll store, creating its tables if necessary.
+  """
+  conn = sqlite3.connect(store_path)
+  conn.execute('CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, '
+               'path TEXT UNIQUE, mtime REAL)')
+  conn.execute('CREATE TABLE IF NOT EXISTS players (id INTEGER PRIMARY KEY, '
+               'name TEXT UNIQUE)')
+  conn.execute('CREATE TABLE IF NOT EXISTS rolls (game INTEGER, seq INTEGER, '
+               'player INTEGER, dice1 INTEGER, dice2 INTEGER, '
+               'PRIMARY KEY (game, seq)) WITHOUT ROWID')
+  return conn
+
+def Ingest(conn, directory, workers):
+  """
+  Parse the new or changed roll histories in directory, in parallel, and add
+  their rolls to the store. Returns the number of games ingested.
+  """
+  known = dict(conn.execute('SELECT path, mtime FROM games'))
+  paths = []
+  for entry in os.scandir(directory):
+    if entry.is_file():
+      path = os.path.abspath(entry.path)
+      if known.get(path) != entry.stat().st_mtime:
+        paths.append((path, entry.stat().st_mtime))
+  players = dict(conn.execute('SELECT name, id FROM players'))
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+    results = executor.map(ParseFile, [path for path, mtime in paths],
+                           chunksize=16)
+    with conn:
+      for (path, mtime), rolls in zip(paths, results):
+        row = conn.execute('SELECT id FROM games WHERE path = ?',
+                           (path,)).fetchone()
+        if row:
+          # The file has changed so replace its rolls.
+          game = row[0]
+          conn.execute('DELETE FROM rolls WHERE game = ?', (game,))
+          conn.execute('UPDATE games SET mtime = ? WHERE id = ?', (mtime, game))
+        else:
+          game = conn.execute('INSERT INTO games (path, mtime) VALUES (?, ?)',
+                              (path, mtime)).lastrowid
+        records = []
+        for seq, (person, dice1, dice2) in enumerate(rolls):
+          if person not in players:
+            players[person] = conn.execute('INSERT INTO players (name) '
+                                           'VALUES (?)', (person,)).lastrowid
+          records.append((game, seq, players[person], dice1, dice2))
+        conn.executemany('INSERT INTO rolls VALUES (?, ?, ?, ?, ?)', records)
+  return len(paths)
+
+def PrintHistogram(histograms, width=None):
+  """
+  Print a histogram of roll totals, where histograms[0] is the count of twos. If
+  width is specified then the bars are scaled to fit.
+  """
+  total = sum(histograms)
+  largest = max(histograms) if total else 0
+  for i in range(len(histograms)):
+    count = histograms[i]
+    if width and largest > width:
+      bar = 'x' * int(count * width / largest + 0.5)
+      print('%2d %s %d (%1.2f%%)' % (i + 2, bar, count, 100.0 * count / total))
+    else:
+      print('%2d %s' % (i + 2, 'x' * count))
+
+def Query(conn, query):
+  """
+  Print a summary of all of the games in the store.
+  """
+  games = conn.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+  rolls = conn.execute('SELECT COUNT(*) FROM rolls').fetchone()[0]
+  print('%d rolls from %d games.' % (rolls, games))
+  if query == 'histogram':
+    # Zero-based is for C/C++, one-based is for Fortran, but two-based is for
+    # dice games. Subtract two when storing data, add two when retrieving it.
+    histograms = [0] * 11
+    for roll, count in conn.execute('SELECT dice1 + dice2, COUNT(*) FROM rolls '
+                                    'GROUP BY dice1 + dice2'):
+      histograms[roll - 2] += count
+    PrintHistogram(histograms, width=60)
+  elif query == 'sevens':
+    for name, sevens, total in conn.execute(
+        'SELECT name, SUM(dice1 + dice2 = 7), COUNT(*) FROM rolls '
+        'JOIN players ON rolls.player = players.id GROUP BY player '
+        'ORDER BY 2 DESC'):
+      print('%5d sevens in %5d rolls (%5.2f%%) by %s' %
+            (sevens, total, 100.0 * sevens / total, name))
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('files', nargs='*', help='Roll histories to summarize. '
+                      'Defaults to stdin.')
+  parser.add_argument('--store', help='Roll store for --ingest and --query.',
+                      default=os.path.join(os.path.expanduser('~'),
+                                           'catan_rolls.sqlite'))
+  parser.add_argument('--ingest', help='Add the roll histories in this '
+                      'directory to the store.')
+  parser.add_argument('--workers', help='Number of processes to use for '
+                      '--ingest.', type=int)
+  parser.add_argument('--query', help='Summarize the rolls in the store.',
+                      choices=['histogram', 'sevens'])
+  parser.add_argument('--analyze', help='Test whether the rolls look fair.',
+                      action='store_true')
+  parser.add_argument('--games', help='Number of games to simulate for '
+                      '--analyze.', type=int, default=1000000)
+  parser.add_argument('--seed', help='Random seed for --analyze.', type=int)
+  args = parser.parse_args()
+
+  if args.ingest or args.query:
+    conn = OpenStore(args.store)
+    if args.ingest:
+      print('Ingested %d games.' % Ingest(conn, args.ingest, args.workers))
+    if args.query:
+      Query(conn, args.query)
+    conn.close()
+    return
+
+  # Zero-based is for C/C++, one-based is for Fortran, but two-based is for dice
+  # games. Subtract two when storing data, add two when retrieving it.
+  histograms = [0] * 11
+
+  sevens = {}
+
+  rolls = ParseRolls(fileinput.input(args.files))
+  for person, dice1, dice2 in rolls:
+    roll = dice1 + dice2
     print('%2d rolled by %s' % (roll, person))
     histograms[roll-2] += 1
     if roll == 7:
       sevens[person] = sevens.get(person, 0) + 1
 
-print()
-print('Rolls histogram:')
-for i in range(len(histograms)):
-  print('%2d %s' % (i + 2, 'x' * histograms[i]))
+  print()
+  print('Rolls histogram:')
+  PrintHistogram(histograms)
+
+  print('')
+  for name in sevens.keys():
+    print('%2d sevens rolled by %s' % (sevens[name], name))
+
+  if args.analyze:
+    print('')
+    Analyze(rolls, args.games, args.seed)
+
 
-print('')
-for name in sevens.keys():
-  print('%2d sevens rolled by %s' % (sevens[name], name))
+if __name__ == '__main__':
+  main()
@@ -1,8 +1,112 @@
-def flu_sum(filename):
-  total = 0
-  for line in open(filename).readlines()[1:]:
-    total += sum(int(x) for x in line.strip().split(',')[3:])
-  return total
-
-print(flu_sum('FluView_StackedColumnChart_Data.csv'))
-print(flu_sum('FluView_StackedColumnChart_Data (1).csv'))
+"""
+Sum the numeric columns of FluView CSV exports, such as
+FluView_StackedColumnChart_Data.csv. By default all columns after the first
+three are summed, for every file matching FluView_StackedColumnChart_Data*.csv
+in the current directory. Sample usage:
+
+  python3 flu_sum.py "exports\*.csv" --columns "A (H1),A (H3)"
+
+Totals are printed for each file, broken down by the REGION and SEASON columns
+when the files have them (see --group-by), followed by grand totals across all
+of the files. The files are parsed with the csv module, so quoted fields work,
+and are processed concurrently by a pool of processes. The values are summed
+with sumclip.py's table grouping, which uses numpy if it is installed.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import itertools
+import math
+import sumclip
+import sys
+
+def SumFile(path, column_names, group_names):
+  """
+  Return the names of the summed columns in path and a dictionary that maps
+  each group key to a list of the column sums for that group. If group_names is
+  None then the REGION and SEASON columns, if present, are used. Values that
+  aren't numbers are skipped. Returns None if the file is empty.
+  """
+  with open(path, newline='', encoding='utf-8-sig') as f:
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+      return None
+    if not column_names:
+      column_names = header[3:]
+    if group_names is None:
+      lower_header = [column.strip().lower() for column in header]
+      group_names = [name for name in ['REGION', 'SEASON'] if name.lower() in
+                     lower_header]
+    keys, row_counts, results = sumclip.GroupRows(
+        header, (row for row in reader if row), group_names, column_names)
+  return (list(results),
+          {key: [float(sums[code]) for sums, counts, maxes in results.values()]
+           for code, key in enumerate(keys)})
+
+def FormatNumber(value):
+  if math.isfinite(value) and value == int(value):
+    return '%d' % value
+  return '%1.3f' % value
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('patterns', nargs='*', help='Glob patterns of the CSV '
+                      'files to sum.',
+                      default=['FluView_StackedColumnChart_Data*.csv'])
+  parser.add_argument('--columns', help='Comma separated names of the columns '
+                      'to sum. Defaults to all columns after the first three.')
+  parser.add_argument('--group-by', help='Comma separated names of the columns '
+                      'to group the totals by. Defaults to REGION and SEASON, '
+                      'if present. Pass an empty string for no grouping.')
+  parser.add_argument('--workers', help='Number of processes to use.',
+                      type=int)
+  args = parser.parse_args()
+  column_names = args.columns.split(',') if args.columns else None
+  group_names = None
+  if args.group_by is not None:
+    group_names = args.group_by.split(',') if args.group_by else []
+
+  paths = sorted(set(itertools.chain.from_iterable(glob.glob(pattern) for
+                                                   pattern in args.patterns)))
+  if not paths:
+    print('No files match %s.' % ', '.join(args.patterns))
+    return 1
+
+  try:
+    if len(paths) == 1:
+      results = [SumFile(paths[0], column_names, group_names)]
+    else:
+      with concurrent.futures.ProcessPoolExecutor(
+          max_workers=args.workers) as executor:
+        results = list(executor.map(SumFile, paths,
+                                    itertools.repeat(column_names),
+                                    itertools.repeat(group_names)))
+  except ValueError as e:
+    print(e)
+    return 1
+
+  grand_totals = {}
+  for path, result in zip(paths, results):
+    if result is None:
+      print('Skipping %s, which is empty.' % path)
+      continue
+    columns, groups = result
+    print('%s\t%s' % (FormatNumber(sum(sum(sums) for sums in groups.values())),
+                      path))
+    for key in sorted(groups):
+      if key:
+        print('  %s\t%s' % (FormatNumber(sum(groups[key])), ' | '.join(key)))
+      grand_totals[key] = grand_totals.get(key, 0) + sum(groups[key])
+  if len(paths) > 1:
+    print('%s\tTotal' % FormatNumber(sum(grand_totals.values())))
+    for key in sorted(grand_totals):
+      if key:
+        print('  %s\t%s' % (FormatNumber(grand_totals[key]), ' | '.join(key)))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
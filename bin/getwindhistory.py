@@ -5,62 +5,603 @@ The too-wide header for the data in its 205-column glory looks like this:
                   Temp     Hi    Low   Out    Dew  Wind  Wind   Wind    Hi    Hi   Wind   Heat    THW                Rain    Heat    Cool    In     In    In     In     In   In Air  Wind  Wind    ISS   Arc.
   Date    Time     Out   Temp   Temp   Hum    Pt. Speed   Dir    Run Speed   Dir  Chill  Index  Index   Bar    Rain  Rate    D-D     D-D    Temp   Hum    Dew   Heat    EMC Density  Samp   Tx   Recept  Int.
 
-The summarizing is simply a matter of grabbing specific column ranges.
+The columns are found from that header, each one ending where its bottom
+header word ends, and are extracted for all rows at once.
+
+Parsed rows are kept in a local archive (see --archive) so that history
+accumulates beyond the two-day window of the log. The log is only downloaded
+when it has changed, using If-None-Match/If-Modified-Since, and only rows newer
+than the last archived row are parsed. The --source can be a URL, a file:// URL
+or a local path, which allows working offline. If the log can't be fetched or
+parsed a warning is printed and the archived history is shown.
+
+Any range of the archive can be graphed. The range is split into one bucket
+per terminal column and the min, mean and max wind speed and the prevailing
+direction of each bucket are drawn, followed by a summary of the wind
+directions over the whole range.
 '''
 
-from urllib.request import urlopen
-content = urlopen('https://jsca.bc.ca/main/downld02.txt').read()
-content = content.decode('utf-8').replace('\r\n', '\n')
-
-lines = content.split('\n')
-# Trim the usual blank line from the bottom.
-if not len(lines[-1]):
-  lines = lines[:-1]
-
-speeds = []
-max_speed = 1.0
-for line in lines[3:]:
-  speed = float(line[50:55])
-  if speed > max_speed:
-    max_speed = speed
-  speeds.append(speed)
-
-# Put the headers at the bottom also.
-lines = lines + [lines[2]] + lines[:2]
-
-# Print everything.
-for line in lines:
-  # First 16 columns gives us date/time.
-  # Columns 50:61 gives us wind speed and direction.
-  print('%s%s' % (line[:16], line[50:61]))
-
-# Now print an ASCII art graph of wind speeds:
-v_scale = 1
-print()
-
-num_rows = int(max_speed * v_scale + 0.5) + 1
-rows = []
-for row_num in range(num_rows):
-  # Create an empty row with '|' as every fourth column.
-  empty_row = [' ', ' ', ' ', '|'] * (int((len(speeds) + 3) / 4))
-  # Make the row exactly the right size.
-  rows.append(empty_row[:len(speeds)])
-
-for index, speed in enumerate(speeds):
-  y = int(speed * v_scale + 0.5)
-  rows[y][index] = '*'
-
-for index, row in enumerate(reversed(rows)):
-  speed = len(rows) - index - 1
-  print('%2d %s %2d' % (speed, ''.join(row), speed))
-print('-' * (len(rows[0]) + 6))
-
-for hour_digit in range(2):
-  print('   ', end='')
-  for line in lines[3:]:
-    if line[12:14] == '00':
-      hour = line[9:11]
-      print('%s' % hour[1 - hour_digit], end='')
+import argparse
+import array
+import bisect
+import calendar
+import collections
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import time
+import urllib.parse
+import urllib.request
+from urllib.error import HTTPError, URLError
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+default_source = 'https://jsca.bc.ca/main/downld02.txt'
+archive_magic = b'WINDARCHIVE1\n'
+
+# The date and time of each row are in the first 16 characters.
+timestamp_width = 16
+
+# Seconds since the epoch of each date seen by ParseTimestamp.
+day_cache = {}
+
+compass_points = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+                  'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
+
+Column = collections.namedtuple('Column', ['name', 'start', 'end'])
+
+
+def ParseLayout(header_lines):
+  '''
+  Return a Column for each column after the timestamp, as described by the two
+  header lines. Values are right-aligned with the bottom header word, and each
+  column starts where the previous one ends. The top header words are not
+  quite aligned, so each is attached to the bottom word it overlaps most.
+  '''
+  top, bottom = header_lines
+  bottom_words = [match for match in re.finditer(r'\S+', bottom)
+                  if match.end() > timestamp_width]
+  if not bottom_words:
+    raise ValueError('No columns found in header "%s"' % bottom)
+  top_words = [[] for match in bottom_words]
+  for match in re.finditer(r'\S+', top):
+    if match.end() <= timestamp_width:
+      continue
+    def Overlap(index):
+      word = bottom_words[index]
+      return (min(match.end(), word.end()) - max(match.start(), word.start()),
+              -abs(match.end() - word.end()))
+    top_words[max(range(len(bottom_words)), key=Overlap)].append(match.group())
+  columns = []
+  start = timestamp_width
+  for words, match in zip(top_words, bottom_words):
+    name = ' '.join(words + [match.group()])
+    # Make repeated names, if any, unique.
+    names = [column.name for column in columns]
+    if name in names:
+      name = '%s %d' % (name, names.count(name) + 1)
+    columns.append(Column(name, start, match.end()))
+    start = match.end()
+  return columns
+
+
+def ParseValue(text):
+  '''
+  Convert a column of a log row to a float. Compass directions are converted to
+  degrees, and missing values such as '---' are converted to NaN.
+  '''
+  text = text.strip()
+  if text in compass_points:
+    return compass_points.index(text) * 22.5
+  try:
+    return float(text)
+  except ValueError:
+    return float('nan')
+
+
+def ExtractColumns(lines, columns):
+  '''
+  Return an array('d') of the values of each column in lines, as converted by
+  ParseValue. With numpy the lines are copied into a two-dimensional character
+  array and each column is converted with a single call, falling back to
+  converting just the distinct values of columns that aren't all numbers.
+  '''
+  width = columns[-1].end
+  if numpy is None:
+    results = []
+    for column in columns:
+      cache = {}
+      values = array.array('d')
+      for line in lines:
+        text = line[column.start:column.end]
+        if text not in cache:
+          cache[text] = ParseValue(text)
+        values.append(cache[text])
+      results.append(values)
+    return results
+
+  text = ''.join(line[:width].ljust(width) for line in lines)
+  block = numpy.frombuffer(text.encode('ascii', 'replace'), dtype='S1')
+  block = block.reshape(len(lines), width)
+  results = []
+  for column in columns:
+    field = numpy.ascontiguousarray(block[:, column.start:column.end])
+    field = field.view('S%d' % (column.end - column.start)).ravel()
+    try:
+      values = field.astype(float)
+    except ValueError:
+      distinct, inverse = numpy.unique(field, return_inverse=True)
+      values = numpy.array([ParseValue(value.decode('ascii'))
+                            for value in distinct])[inverse]
+    results.append(array.array('d', values.tobytes()))
+  return results
+
+
+def IsDirection(name):
+  return name.split()[-1] == 'Dir'
+
+
+def FormatDirection(degrees):
+  if degrees != degrees:
+    return '---'
+  return compass_points[int(degrees / 22.5 + 0.5) % len(compass_points)]
+
+
+def FormatValue(name, value):
+  if IsDirection(name):
+    return FormatDirection(value)
+  if value != value:
+    return '---'
+  return ('%.3f' % value).rstrip('0').rstrip('.')
+
+
+def ParseTimestamp(line):
+  '''
+  Return the date and time at the start of a log row, such as
+  '10/16/26  1:05p', as seconds since the epoch, treating local time as UTC.
+  Raises ValueError for lines that aren't data rows. Dates repeat for hundreds
+  of rows so each is only parsed once.
+  '''
+  fields = line[:timestamp_width].split()
+  if len(fields) != 2:
+    raise ValueError('No timestamp in "%s"' % line)
+  date, hour_minute = fields
+  day = day_cache.get(date)
+  if day is None:
+    day = calendar.timegm(time.strptime(date, '%m/%d/%y'))
+    day_cache[date] = day
+  suffix = hour_minute[-1:]
+  hour, minute = hour_minute.rstrip('ap').split(':')
+  hour = int(hour)
+  if suffix in ('a', 'p'):
+    if not 1 <= hour <= 12:
+      raise ValueError('Bad hour in "%s"' % line)
+    hour = hour % 12 + (12 if suffix == 'p' else 0)
+  return day + hour * 3600 + int(minute) * 60
+
+
+def FormatTimestamp(timestamp):
+  '''
+  Format a timestamp the way the log does, as '10/16/26  1:05p'.
+  '''
+  t = time.gmtime(timestamp)
+  hour = t.tm_hour % 12 or 12
+  return '%s %2d:%02d%s' % (time.strftime('%m/%d/%y', t), hour, t.tm_min,
+                            'a' if t.tm_hour < 12 else 'p')
+
+
+def ReadSource(source, validators):
+  '''
+  Return the contents of source, and the validators to pass next time, or None
+  if source hasn't changed since validators were returned. The validators are
+  the ETag and Last-Modified headers for http(s) sources and the size and
+  modification time for files.
+  '''
+  parsed = urllib.parse.urlparse(source)
+  if parsed.scheme in ('http', 'https'):
+    request = urllib.request.Request(source)
+    if validators.get('etag'):
+      request.add_header('If-None-Match', validators['etag'])
+    if validators.get('last_modified'):
+      request.add_header('If-Modified-Since', validators['last_modified'])
+    try:
+      with urllib.request.urlopen(request) as response:
+        return response.read(), {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            }
+    except HTTPError as e:
+      if e.code == 304:
+        return None, validators
+      raise
+  path = source
+  if parsed.scheme == 'file':
+    path = urllib.request.url2pathname(parsed.path)
+  stat = os.stat(path)
+  new_validators = {'size': stat.st_size, 'mtime': stat.st_mtime}
+  if new_validators == validators:
+    return None, validators
+  with open(path, 'rb') as f:
+    return f.read(), new_validators
+
+
+class Archive:
+  '''
+  Wind history rows, stored as one array of timestamps and one array of values
+  per column, all in timestamp order. On disk this is a line of JSON describing
+  the arrays followed by their raw contents.
+  '''
+  def __init__(self):
+    self.column_names = []
+    self.times = array.array('q')
+    self.columns = []
+    self.source = None
+    self.validators = {}
+
+  @classmethod
+  def Load(cls, path):
+    '''
+    Load the archive at path, or return an empty one if it doesn't exist or
+    can't be read.
+    '''
+    archive = cls()
+    try:
+      with open(path, 'rb') as f:
+        if f.readline() != archive_magic:
+          return archive
+        header = json.loads(f.readline())
+        archive.times.fromfile(f, header['count'])
+        for name in header['columns']:
+          column = array.array('d')
+          column.fromfile(f, header['count'])
+          archive.column_names.append(name)
+          archive.columns.append(column)
+        archive.source = header['source']
+        archive.validators = header['validators']
+    except (OSError, EOFError, ValueError, KeyError):
+      return cls()
+    return archive
+
+  def Save(self, path):
+    '''
+    Write the archive to path, renaming it into place once it is complete.
+    '''
+    header = {
+        'columns': self.column_names,
+        'count': len(self.times),
+        'source': self.source,
+        'validators': self.validators,
+        }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+      f.write(archive_magic)
+      f.write(json.dumps(header).encode('utf-8') + b'\n')
+      self.times.tofile(f)
+      for column in self.columns:
+        column.tofile(f)
+    os.replace(temp_path, path)
+
+  def Column(self, name):
+    return self.columns[self.column_names.index(name)]
+
+  def AddRows(self, lines):
+    '''
+    Parse and append the data rows in lines, a whole log including its header,
+    that are newer than the last archived row. Rows are in time order so the
+    lines are scanned backwards, stopping at the first row that is already
+    archived. Local time is treated as UTC, so when the clocks go back the
+    repeated hour would go backwards in time, and rows that aren't newer than
+    the row before them are dropped. Columns that are new to the archive are
+    filled with NaN for the older rows. Returns the number of rows added.
+    '''
+    layout = ParseLayout(lines[:2])
+    last_time = self.times[-1] if self.times else -sys.maxsize
+    rows = []
+    for line in reversed(lines[3:]):
+      try:
+        timestamp = ParseTimestamp(line)
+      except ValueError:
+        continue
+      if timestamp <= last_time:
+        break
+      rows.append((timestamp, line))
+    new_times = []
+    new_lines = []
+    for timestamp, line in reversed(rows):
+      if timestamp > last_time:
+        new_times.append(timestamp)
+        new_lines.append(line)
+        last_time = timestamp
+    if not new_lines:
+      return 0
+
+    for column in layout:
+      if column.name not in self.column_names:
+        self.column_names.append(column.name)
+        self.columns.append(array.array('d', [float('nan')]) *
+                            len(self.times))
+    new_values = dict(zip([column.name for column in layout],
+                          ExtractColumns(new_lines, layout)))
+    missing = array.array('d', [float('nan')]) * len(new_lines)
+    for name, column in zip(self.column_names, self.columns):
+      column.extend(new_values.get(name, missing))
+    self.times.extend(new_times)
+    return len(new_lines)
+
+  def Update(self, source):
+    '''
+    Fetch source if it has changed and add its new rows. Returns the number of
+    rows added.
+    '''
+    validators = self.validators if source == self.source else {}
+    content, validators = ReadSource(source, validators)
+    self.source = source
+    self.validators = validators
+    if content is None:
+      return 0
+    content = content.decode('utf-8').replace('\r\n', '\n')
+    return self.AddRows(content.split('\n'))
+
+  def Range(self, start, end):
+    '''
+    Return the slice of rows with start <= timestamp < end.
+    '''
+    return slice(bisect.bisect_left(self.times, start),
+                 bisect.bisect_left(self.times, end))
+
+
+def PrintRows(archive, rows, column_names):
+  '''
+  Print the selected rows and columns, with the headers at the bottom also.
+  '''
+  widths = [max([6] + [len(word) + 1 for word in name.split()])
+            for name in column_names]
+  tops = [' '.join(name.split()[:-1]) for name in column_names]
+  bottoms = [name.split()[-1] for name in column_names]
+  headers = [' ' * timestamp_width +
+             ''.join(top.rjust(width) for top, width in zip(tops, widths)),
+             '  Date    Time  '.ljust(timestamp_width) +
+             ''.join(bottom.rjust(width) for bottom, width in
+                     zip(bottoms, widths))]
+  headers.append('-' * len(headers[1]))
+  columns = [archive.Column(name)[rows] for name in column_names]
+  lines = headers[:]
+  for index, timestamp in enumerate(archive.times[rows]):
+    lines.append(FormatTimestamp(timestamp).ljust(timestamp_width) +
+                 ''.join(' ' + FormatValue(name, column[index]).rjust(width - 1)
+                         for name, column, width in
+                         zip(column_names, columns, widths)))
+  lines += [headers[2]] + headers[:2]
+  for line in lines:
+    print(line)
+
+
+def Downsample(times, speeds, directions, start, end, width):
+  '''
+  Split [start, end) into width equal buckets and return lists of the min,
+  mean and max speed of each bucket, NaN if it has no speeds, and its
+  prevailing direction. The prevailing direction is the speed weighted vector
+  mean, NaN if the bucket is calm. times must lie within [start, end).
+  '''
+  nan = float('nan')
+  span = end - start
+  if numpy is not None:
+    times = numpy.frombuffer(times, dtype=numpy.int64)
+    speeds = numpy.frombuffer(speeds, dtype=float)
+    directions = numpy.frombuffer(directions, dtype=float)
+    buckets = (times - start) * width // span
+    valid = ~numpy.isnan(speeds)
+    counts = numpy.bincount(buckets, weights=valid, minlength=width)
+    sums = numpy.bincount(buckets, weights=numpy.where(valid, speeds, 0),
+                          minlength=width)
+    means = numpy.full(width, nan)
+    numpy.divide(sums, counts, out=means, where=counts > 0)
+    # Rows are in time order so each bucket is a contiguous run, which lets
+    # reduceat find the extremes of all of the non-empty buckets at once.
+    firsts = numpy.searchsorted(buckets, numpy.arange(width))
+    occupied = numpy.flatnonzero(numpy.bincount(buckets, minlength=width))
+    mins = numpy.full(width, nan)
+    maxes = numpy.full(width, nan)
+    if len(occupied):
+      mins[occupied] = numpy.fmin.reduceat(speeds, firsts[occupied])
+      maxes[occupied] = numpy.fmax.reduceat(speeds, firsts[occupied])
+    weights = numpy.where(valid & ~numpy.isnan(directions), speeds, 0)
+    radians = numpy.radians(numpy.nan_to_num(directions))
+    x = numpy.bincount(buckets, weights=weights * numpy.sin(radians),
+                       minlength=width)
+    y = numpy.bincount(buckets, weights=weights * numpy.cos(radians),
+                       minlength=width)
+    prevailing = numpy.where((x == 0) & (y == 0), nan,
+                             numpy.degrees(numpy.arctan2(x, y)) % 360)
+    return mins.tolist(), means.tolist(), maxes.tolist(), prevailing.tolist()
+
+  mins = [nan] * width
+  maxes = [nan] * width
+  sums = [0.0] * width
+  counts = [0] * width
+  x = [0.0] * width
+  y = [0.0] * width
+  for timestamp, speed, direction in zip(times, speeds, directions):
+    if speed != speed:
+      continue
+    bucket = (timestamp - start) * width // span
+    # NaN compares false, so empty buckets take the first speed.
+    if not speed >= mins[bucket]:
+      mins[bucket] = speed
+    if not speed <= maxes[bucket]:
+      maxes[bucket] = speed
+    sums[bucket] += speed
+    counts[bucket] += 1
+    if direction == direction:
+      x[bucket] += speed * math.sin(math.radians(direction))
+      y[bucket] += speed * math.cos(math.radians(direction))
+  means = [total / count if count else nan for total, count in
+           zip(sums, counts)]
+  prevailing = [nan if x_sum == 0 and y_sum == 0 else
+                math.degrees(math.atan2(x_sum, y_sum)) % 360
+                for x_sum, y_sum in zip(x, y)]
+  return mins, means, maxes, prevailing
+
+
+def PrintGraph(archive, start, end, width, height):
+  '''
+  Print an ASCII art graph of the wind speeds from start to end, one column
+  per bucket, with '*' at the mean speed and ':' spanning the min to max. The
+  prevailing direction of each bucket is written vertically underneath,
+  followed by a time axis.
+  '''
+  rows = archive.Range(start, end)
+  mins, means, maxes, prevailing = Downsample(
+      archive.times[rows], archive.Column('Wind Speed')[rows],
+      archive.Column('Wind Dir')[rows], start, end, width)
+  max_speed = max([1.0] + [speed for speed in maxes if speed == speed])
+  v_scale = min(1.0, (height - 1) / max_speed)
+
+  # Mark the buckets that contain a tick, choosing the shortest tick interval
+  # that leaves room for a label.
+  span = end - start
+  for tick in [3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600, 7 * 24 * 3600]:
+    if tick * width >= span * 8:
+      break
+  ticks = {}
+  for tick_time in range(start + (-start) % tick, end, tick):
+    t = time.gmtime(tick_time)
+    if t.tm_hour:
+      label = '%d%s' % (t.tm_hour % 12 or 12, 'a' if t.tm_hour < 12 else 'p')
     else:
-      print(' ', end='')
+      label = time.strftime('%m/%d', t)
+    ticks[(tick_time - start) * width // span] = label
+
+  num_rows = int(max_speed * v_scale + 0.5) + 1
+  graph = []
+  for row_num in range(num_rows):
+    graph.append(['|' if x in ticks else ' ' for x in range(width)])
+  for x, (low, mean, high) in enumerate(zip(mins, means, maxes)):
+    if mean != mean:
+      continue
+    for y in range(int(low * v_scale + 0.5), int(high * v_scale + 0.5) + 1):
+      graph[y][x] = ':'
+    graph[int(mean * v_scale + 0.5)][x] = '*'
+
   print()
+  for index, row in enumerate(reversed(graph)):
+    speed = (len(graph) - index - 1) / v_scale
+    print('%3.0f %s %3.0f' % (speed, ''.join(row), speed))
+  print('-' * (width + 8))
+
+  # Write the prevailing directions vertically, bottom aligned.
+  directions = [FormatDirection(degrees).rjust(3) if degrees == degrees
+                else '   ' for degrees in prevailing]
+  for letter in range(3):
+    print('    %s' % ''.join(direction[letter] for direction in directions))
+
+  axis = [' '] * width
+  labels = [' '] * (width + 8)
+  label_end = 0
+  for x in sorted(ticks):
+    axis[x] = '|'
+    if x >= label_end:
+      labels[x:x + len(ticks[x])] = ticks[x]
+      label_end = x + len(ticks[x]) + 1
+  print('    %s' % ''.join(axis))
+  print('    %s' % ''.join(labels).rstrip())
+
+
+def PrintDirectionSummary(archive, start, end):
+  '''
+  Print how often the wind came from each compass point from start to end, and
+  its mean and peak speed when it did.
+  '''
+  rows = archive.Range(start, end)
+  counts = [0] * len(compass_points)
+  sums = [0.0] * len(compass_points)
+  peaks = [0.0] * len(compass_points)
+  calm = 0
+  for speed, direction in zip(archive.Column('Wind Speed')[rows],
+                              archive.Column('Wind Dir')[rows]):
+    if direction != direction or speed != speed:
+      calm += 1
+      continue
+    point = int(direction / 22.5 + 0.5) % len(compass_points)
+    counts[point] += 1
+    sums[point] += speed
+    peaks[point] = max(peaks[point], speed)
+  total = sum(counts) + calm
+  if not total:
+    return
+  print()
+  print('Dir   Time   Mean   Peak')
+  for point, count in enumerate(counts):
+    if count:
+      print('%-4s %4.1f%% %6.1f %6.1f' % (compass_points[point],
+                                          count * 100.0 / total,
+                                          sums[point] / count, peaks[point]))
+  if calm:
+    print('%-4s %4.1f%%' % ('Calm', calm * 100.0 / total))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--source', help='URL, file:// URL or path of the wind '
+                      'log. Defaults to %(default)s.', default=default_source)
+  parser.add_argument('--archive', help='Archive of previously fetched rows.',
+                      default=os.path.join(os.path.expanduser('~'),
+                                           'WindHistoryArchive.dat'))
+  parser.add_argument('--days', help='Number of days of history to show.',
+                      type=float, default=2.0)
+  parser.add_argument('--end', help='Date, as YYYY-MM-DD, that the history '
+                      'shown ends on. Defaults to the newest row.')
+  parser.add_argument('--list', help='Print every row. This is the default '
+                      'for two days or less.', action='store_true')
+  parser.add_argument('--columns', help='Comma separated names of the columns '
+                      'to list.', default='Wind Speed,Wind Dir')
+  parser.add_argument('--width', help='Width of the graph, in buckets. '
+                      'Defaults to the terminal width.', type=int)
+  parser.add_argument('--height', help='Maximum height of the graph, in rows.',
+                      type=int, default=25)
+  parser.add_argument('--offline', help='Show the archive without fetching.',
+                      action='store_true')
+  args = parser.parse_args()
+
+  archive = Archive.Load(args.archive)
+  if not args.offline:
+    validators = archive.validators
+    try:
+      added = archive.Update(args.source)
+    except (URLError, OSError, ValueError) as e:
+      print('Warning: failed to read %s - %s' % (args.source, e))
+      print('Showing the archived history only.')
+    else:
+      if added or archive.validators != validators:
+        archive.Save(args.archive)
+  if not archive.times:
+    print('No wind history in %s.' % args.archive)
+    return 1
+  column_names = args.columns.split(',')
+  for name in column_names + ['Wind Speed', 'Wind Dir']:
+    if name not in archive.column_names:
+      print('Column "%s" not found. Columns are: %s' %
+            (name, ', '.join(archive.column_names)))
+      return 1
+
+  if args.end:
+    end = calendar.timegm(time.strptime(args.end, '%Y-%m-%d')) + 24 * 3600
+  else:
+    end = archive.times[-1] + 1
+  start = end - int(args.days * 24 * 3600)
+  width = args.width or shutil.get_terminal_size().columns - 8
+
+  if args.list or args.days <= 2:
+    PrintRows(archive, archive.Range(start, end), column_names)
+  PrintGraph(archive, start, end, width, args.height)
+  PrintDirectionSummary(archive, start, end)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
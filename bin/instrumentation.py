@@ -0,0 +1,204 @@
+# Copyright 2021 Bruce Dawson. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""
+Per-phase timing and profiling for the scripts in this directory.
+
+A script calls AddArguments on its parser to get the --timings, --timings-log
+and --profile flags, calls Start once the arguments are parsed, and wraps each
+phase of its work like this:
+
+  with instrumentation.Phase('scan'):
+    ...
+    instrumentation.Count('files', len(files))
+
+Phases do nothing unless --timings was passed. When it was, a JSON line is
+appended to the --timings-log file (~\tool_timings.jsonl by default) for each
+phase, and one for the whole run, with the wall time, the CPU time, the bytes
+read and written by the process, and any counts recorded during the phase.
+Phases can be nested and are named by their path, such as 'rebuild/ratings'.
+CPU time includes child processes that have exited, on platforms that report
+them. With --profile the whole run is profiled with cProfile and the statistics
+are written to a file that can be loaded with pstats or snakeviz.
+
+Tracking the log over time, for example for scheduled runs, shows which phase
+is responsible for a regression.
+"""
+
+import atexit
+import contextlib
+import cProfile
+import ctypes
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+default_log_path = os.path.join(os.path.expanduser('~'), 'tool_timings.jsonl')
+
+# The Recorder for this run, or None if --timings wasn't passed.
+recorder = None
+profiler = None
+profile_path = None
+
+def ReadIoCounters():
+  """
+  Return the number of bytes that this process has read and written, or
+  (None, None) if the platform doesn't make that available.
+  """
+  if sys.platform == 'win32':
+    class IO_COUNTERS(ctypes.Structure):
+      _fields_ = [(name, ctypes.c_ulonglong) for name in
+                  ['ReadOperationCount', 'WriteOperationCount',
+                   'OtherOperationCount', 'ReadTransferCount',
+                   'WriteTransferCount', 'OtherTransferCount']]
+    counters = IO_COUNTERS()
+    kernel32 = ctypes.windll.kernel32
+    if kernel32.GetProcessIoCounters(kernel32.GetCurrentProcess(),
+                                     ctypes.byref(counters)):
+      return counters.ReadTransferCount, counters.WriteTransferCount
+    return None, None
+  try:
+    with open('/proc/self/io') as f:
+      fields = dict(line.split(':') for line in f)
+    return int(fields['rchar']), int(fields['wchar'])
+  except (OSError, KeyError, ValueError):
+    return None, None
+
+def ReadCpuTime():
+  """
+  Return the CPU time used by this process and its exited children.
+  """
+  times = os.times()
+  return time.process_time() + times.children_user + times.children_system
+
+class Recorder:
+  """
+  Measures phases and appends a JSON line for each to the log.
+  """
+  def __init__(self, tool, log_path):
+    self.tool = tool
+    self.log_path = log_path
+    self.run = datetime.datetime.now().isoformat(timespec='seconds')
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.start = self.Sample()
+
+  def Sample(self):
+    read_bytes, write_bytes = ReadIoCounters()
+    return time.perf_counter(), ReadCpuTime(), read_bytes, write_bytes
+
+  def Stack(self):
+    # Each thread has its own stack of (name, counts) for the open phases.
+    if not hasattr(self.local, 'stack'):
+      self.local.stack = []
+    return self.local.stack
+
+  def Write(self, name, start, counts):
+    end = self.Sample()
+    record = {
+        'tool': self.tool,
+        'run': self.run,
+        'pid': os.getpid(),
+        'phase': name,
+        'wall': round(end[0] - start[0], 6),
+        'cpu': round(end[1] - start[1], 6),
+        }
+    if start[2] is not None and end[2] is not None:
+      record['read_bytes'] = end[2] - start[2]
+      record['write_bytes'] = end[3] - start[3]
+    record.update(counts)
+    with self.lock:
+      with open(self.log_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+  @contextlib.contextmanager
+  def Phase(self, name):
+    stack = self.Stack()
+    counts = {}
+    stack.append((name, counts))
+    full_name = '/'.join(name for name, counts in stack)
+    start = self.Sample()
+    try:
+      yield
+    finally:
+      stack.pop()
+      self.Write(full_name, start, counts)
+
+  def Count(self, name, value):
+    stack = self.Stack()
+    if stack:
+      counts = stack[-1][1]
+      counts[name] = counts.get(name, 0) + value
+
+def AddArguments(parser):
+  """
+  Add the --timings, --timings-log and --profile arguments to an argparse
+  parser.
+  """
+  parser.add_argument('--timings', help='Append the time taken by each phase '
+                      'to the --timings-log file, as JSON lines.',
+                      action='store_true')
+  parser.add_argument('--timings-log', help='File for --timings. Defaults to '
+                      '%s.' % default_log_path, default=default_log_path,
+                      metavar='LOG')
+  parser.add_argument('--profile', help='Profile the run with cProfile and '
+                      'write the statistics to this file.', metavar='FILE')
+
+def Start(tool, args):
+  """
+  Start recording phases and profiling as requested by the parsed arguments.
+  The totals are written and the profile is saved when the process exits.
+  """
+  global recorder, profiler, profile_path
+  if args.timings:
+    recorder = Recorder(tool, args.timings_log)
+  if args.profile:
+    profile_path = args.profile
+    profiler = cProfile.Profile()
+    profiler.enable()
+  atexit.register(Finish)
+
+def Finish():
+  """
+  Write the record for the whole run and save the profile, if any.
+  """
+  global recorder, profiler
+  if profiler:
+    profiler.disable()
+    profiler.dump_stats(profile_path)
+    print('Profile written to %s.' % profile_path)
+    profiler = None
+  if recorder:
+    recorder.Write('total', recorder.start, {})
+    print('Timings appended to %s.' % recorder.log_path)
+    recorder = None
+
+def Phase(name):
+  """
+  Return a context manager that records the phase called name, if timings are
+  enabled.
+  """
+  if recorder is None:
+    return contextlib.nullcontext()
+  return recorder.Phase(name)
+
+def Count(name, value=1):
+  """
+  Add value to the count called name for the innermost phase on this thread.
+  """
+  if recorder is not None:
+    recorder.Count(name, value)
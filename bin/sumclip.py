@@ -22,37 +22,483 @@ from ETW traces. Just select all data, control-clicking as needed to deselect
 particular rows, then right-click in the column-> Copy Other-> Copy Column
 Selection. Then run this tool. This tool assumes that commas can be discarded
 and will fail in many non-English locales.
+
+Data can also be read from files named on the command line or piped in on
+stdin, which also allows this tool to be used on non-Windows systems. Lines are
+parsed in batches (using numpy, if it is installed) and along with the count,
+sum, min, average, and max the median, p90, p99, p99.9, and standard deviation
+are printed. By default the percentiles are exact, which requires storing every
+value. With --approximate they are instead calculated from a log-bucketed
+histogram that uses bounded memory and is accurate to within 1%.
+
+With --group-by the input is instead treated as a whole WPA table copied with
+its header row (tab separated). The numeric --columns are aggregated (sum,
+count, mean, max) grouped by one or more key columns, and the groups are printed
+as a tab separated table sorted by any of the aggregates. For example:
+
+  python3 sumclip.py --group-by Process --columns "CPU Usage (ms)"
 """
 
 from __future__ import print_function
 
+import argparse
+import array
+import math
 import sys
-import win32clipboard
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
-def main():
+batch_size = 65536
+
+class LogHistogram:
+  """
+  A mergeable quantile sketch that uses bounded memory. Values are counted in
+  buckets whose boundaries grow geometrically so that the estimate for any
+  quantile is within relative_accuracy of the true value. Infinities are
+  counted below and above all of the buckets, and NaNs are counted but left out
+  of the quantiles.
+  """
+  def __init__(self, relative_accuracy=0.01):
+    self.relative_accuracy = relative_accuracy
+    self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.positive = {}
+    self.negative = {}
+    self.zero_count = 0
+    self.negative_infinity_count = 0
+    self.positive_infinity_count = 0
+    self.nan_count = 0
+    # The number of values that aren't NaN.
+    self.count = 0
+
+  def AddBatch(self, values):
+    if numpy is not None:
+      values = numpy.asarray(values, dtype=float)
+      nan_count = int(numpy.count_nonzero(numpy.isnan(values)))
+      self.nan_count += nan_count
+      self.count += len(values) - nan_count
+      self.negative_infinity_count += int(numpy.count_nonzero(
+          values == -numpy.inf))
+      self.positive_infinity_count += int(numpy.count_nonzero(
+          values == numpy.inf))
+      values = values[numpy.isfinite(values)]
+      self.zero_count += int(numpy.count_nonzero(values == 0))
+      for buckets, selected in [(self.positive, values[values > 0]),
+                                (self.negative, -values[values < 0])]:
+        indices = numpy.ceil(numpy.log(selected) / self.log_gamma)
+        for index, count in zip(*numpy.unique(indices, return_counts=True)):
+          buckets[int(index)] = buckets.get(int(index), 0) + int(count)
+      return
+    for value in values:
+      if not math.isfinite(value):
+        if value != value:
+          self.nan_count += 1
+          continue
+        if value < 0:
+          self.negative_infinity_count += 1
+        else:
+          self.positive_infinity_count += 1
+        self.count += 1
+        continue
+      self.count += 1
+      if value == 0:
+        self.zero_count += 1
+        continue
+      buckets = self.positive if value > 0 else self.negative
+      index = int(math.ceil(math.log(abs(value)) / self.log_gamma))
+      buckets[index] = buckets.get(index, 0) + 1
+
+  def Merge(self, other):
+    for buckets, other_buckets in [(self.positive, other.positive),
+                                   (self.negative, other.negative)]:
+      for index, count in other_buckets.items():
+        buckets[index] = buckets.get(index, 0) + count
+    self.zero_count += other.zero_count
+    self.negative_infinity_count += other.negative_infinity_count
+    self.positive_infinity_count += other.positive_infinity_count
+    self.nan_count += other.nan_count
+    self.count += other.count
+
+  def Quantile(self, q):
+    if not self.count:
+      return float('nan')
+    rank = q * (self.count - 1)
+    seen = self.negative_infinity_count
+    if seen > rank:
+      return -math.inf
+    # Walk the buckets from the most negative value to the most positive.
+    for index in sorted(self.negative, reverse=True):
+      seen += self.negative[index]
+      if seen > rank:
+        return -2 * self.gamma ** index / (self.gamma + 1)
+    seen += self.zero_count
+    if seen > rank:
+      return 0.0
+    for index in sorted(self.positive):
+      seen += self.positive[index]
+      if seen > rank:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+    return math.inf
+
+class Stats:
+  """
+  Streaming statistics over batches of values. The mean and variance are
+  accumulated with Chan's parallel algorithm so that batches, and Stats objects,
+  can be merged without loss of precision.
+  """
+  def __init__(self, approximate=False):
+    self.count = 0
+    self.sum = 0.0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.min = None
+    self.max = None
+    self.histogram = LogHistogram() if approximate else None
+    self.values = None if approximate else array.array('d')
+
+  def AddBatch(self, values):
+    if not len(values):
+      return
+    if numpy is not None:
+      values = numpy.asarray(values, dtype=float)
+      count = len(values)
+      total = float(values.sum())
+      mean = total / count
+      m2 = float(((values - mean) ** 2).sum())
+      batch_min = float(values.min())
+      batch_max = float(values.max())
+    else:
+      count = len(values)
+      try:
+        total = math.fsum(values)
+      except (ValueError, OverflowError):
+        # fsum refuses to add infinities of opposite signs, or to overflow.
+        total = sum(values)
+      mean = total / count
+      m2 = math.fsum((value - mean) ** 2 for value in values)
+      batch_min = min(values)
+      batch_max = max(values)
+    self.MergeMoments(count, total, mean, m2, batch_min, batch_max)
+    if self.histogram:
+      self.histogram.AddBatch(values)
+    elif numpy is not None:
+      self.values.frombytes(values.tobytes())
+    else:
+      self.values.extend(values)
+
+  def MergeMoments(self, count, total, mean, m2, batch_min, batch_max):
+    new_count = self.count + count
+    delta = mean - self.mean
+    self.mean += delta * count / new_count
+    self.m2 += m2 + delta * delta * self.count * count / new_count
+    self.count = new_count
+    self.sum += total
+    self.min = batch_min if self.min is None else min(self.min, batch_min)
+    self.max = batch_max if self.max is None else max(self.max, batch_max)
+
+  def Merge(self, other):
+    if not other.count:
+      return
+    self.MergeMoments(other.count, other.sum, other.mean, other.m2, other.min,
+                      other.max)
+    if self.histogram:
+      self.histogram.Merge(other.histogram)
+    else:
+      self.values.extend(other.values)
+
+  def StdDev(self):
+    return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+  def Quantiles(self, qs):
+    if self.histogram:
+      return [self.histogram.Quantile(q) for q in qs]
+    if numpy is not None:
+      return [float(x) for x in
+              numpy.quantile(numpy.frombuffer(self.values, dtype=float), qs)]
+    values = sorted(self.values)
+    result = []
+    for q in qs:
+      # Linear interpolation between the closest ranks, as numpy does.
+      position = q * (len(values) - 1)
+      lower = int(position)
+      upper = min(lower + 1, len(values) - 1)
+      result.append(values[lower] + (values[upper] - values[lower]) *
+                    (position - lower))
+    return result
+
+def ParseBatch(lines):
+  """
+  Return a list of the values in lines that could be parsed as finite numbers,
+  and the number of lines that couldn't be. Lines such as 'nan' and 'inf' are
+  counted as non-numeric since they would otherwise poison the statistics.
+  """
+  cleaned = [line.replace(',', '').replace('%', '').strip() for line in lines]
+  if numpy is not None:
+    try:
+      # Converting the whole batch at once is much faster, and usually works.
+      values = numpy.array(cleaned, dtype=float)
+      finite = numpy.isfinite(values)
+      return values[finite], len(values) - int(numpy.count_nonzero(finite))
+    except ValueError:
+      pass
+  values = []
+  missed_count = 0
+  for line in cleaned:
+    try:
+      value = float(line)
+    except ValueError:
+      missed_count += 1
+      continue
+    if math.isfinite(value):
+      values.append(value)
+    else:
+      missed_count += 1
+  return values, missed_count
+
+def ParseValues(strings):
+  """
+  Return an array of the values of strings as numbers, with NaN for those that
+  aren't numeric.
+  """
+  # Empty strings are common in tables, so make them NaN up front rather than
+  # letting them force the slow path.
+  cleaned = [string.replace(',', '').replace('%', '').strip() or 'nan' for
+             string in strings]
+  if numpy is not None:
+    try:
+      return numpy.array(cleaned, dtype=float)
+    except ValueError:
+      pass
+  values = array.array('d')
+  for string in cleaned:
+    try:
+      values.append(float(string))
+    except ValueError:
+      values.append(float('nan'))
+  return values
+
+def FindColumn(header, name):
+  """
+  Return the index of the named column, ignoring case and surrounding spaces if
+  there is no exact match.
+  """
+  if name in header:
+    return header.index(name)
+  lower_header = [column.strip().lower() for column in header]
+  if name.strip().lower() in lower_header:
+    return lower_header.index(name.strip().lower())
+  raise ValueError('Column "%s" not found. Columns are: %s' %
+                   (name, ', '.join(header)))
+
+def GroupTable(lines, key_names, column_names):
+  """
+  Aggregate a tab separated table with a header row, skipping blank lines. See
+  GroupRows for the results.
+  """
+  lines = (line for line in lines if line.strip())
+  rows = (line.rstrip('\r\n').split('\t') for line in lines)
+  return GroupRows(next(rows), rows, key_names, column_names)
+
+def GroupRows(header, rows, key_names, column_names):
+  """
+  Aggregate rows, which are lists of fields, with the specified header. Returns
+  a list of the distinct key tuples, an array of the number of rows for each
+  key, and a dictionary that maps each column name to (sums, counts, maxes)
+  arrays, each indexed like the key list. counts is the number of numeric
+  values. Values are stored in columns of doubles with the keys replaced by
+  integer codes, rather than as per-row Python objects.
+  """
+  key_indices = [FindColumn(header, name) for name in key_names]
+  if not column_names:
+    # Default to every non-key column.
+    column_names = [name for index, name in enumerate(header)
+                    if index not in key_indices]
+  column_indices = [FindColumn(header, name) for name in column_names]
+  column_names = [header[index] for index in column_indices]
+  key_codes = {}
+  codes = array.array('q')
+  columns = [array.array('d') for name in column_names]
+  raw = [[] for name in column_names]
+
+  def FlushBatch():
+    for column, strings in zip(columns, raw):
+      column.frombytes(ParseValues(strings).tobytes())
+      del strings[:]
+
+  for fields in rows:
+    if len(fields) < len(header):
+      fields += [''] * (len(header) - len(fields))
+    key = tuple(fields[index] for index in key_indices)
+    codes.append(key_codes.setdefault(key, len(key_codes)))
+    for strings, index in zip(raw, column_indices):
+      strings.append(fields[index])
+    if raw and len(raw[0]) >= batch_size:
+      FlushBatch()
+  FlushBatch()
+
+  group_count = len(key_codes)
+  results = {}
+  if numpy is not None:
+    codes = numpy.frombuffer(codes, dtype=numpy.int64)
+    row_counts = numpy.bincount(codes, minlength=group_count)
+    for name, column in zip(column_names, columns):
+      values = numpy.frombuffer(column, dtype=float)
+      valid = ~numpy.isnan(values)
+      valid_codes = codes[valid]
+      valid_values = values[valid]
+      sums = numpy.bincount(valid_codes, weights=valid_values,
+                            minlength=group_count)
+      counts = numpy.bincount(valid_codes, minlength=group_count)
+      maxes = numpy.full(group_count, -numpy.inf)
+      numpy.maximum.at(maxes, valid_codes, valid_values)
+      results[name] = (sums, counts, maxes)
+  else:
+    row_counts = array.array('q', [0] * group_count)
+    for code in codes:
+      row_counts[code] += 1
+    for name, column in zip(column_names, columns):
+      sums = array.array('d', [0.0] * group_count)
+      counts = array.array('q', [0] * group_count)
+      maxes = array.array('d', [-math.inf] * group_count)
+      for code, value in zip(codes, column):
+        if value == value:  # Skip NaN.
+          sums[code] += value
+          counts[code] += 1
+          if value > maxes[code]:
+            maxes[code] = value
+      results[name] = (sums, counts, maxes)
+  return list(key_codes), row_counts, results
+
+def PrintGroups(key_names, keys, row_counts, results, sort, limit):
+  """
+  Print the aggregated table, sorted by sort, which is 'rows' or
+  'column:aggregate' where aggregate is sum, count, mean, or max. The number of
+  rows in each group is printed as 'Rows' because WPA tables often have a
+  column called Count.
+  """
+  def Aggregates(name, index):
+    sums, counts, maxes = results[name]
+    mean = sums[index] / counts[index] if counts[index] else float('nan')
+    return {'sum': sums[index], 'count': counts[index], 'mean': mean,
+            'max': maxes[index] if counts[index] else float('nan')}
+
+  if sort == 'rows':
+    sort_key = lambda index: row_counts[index]
+  else:
+    name, _, aggregate = sort.rpartition(':')
+    if not name:
+      name, aggregate = sort, 'sum'
+    if aggregate not in ['sum', 'count', 'mean', 'max']:
+      raise ValueError('Bad sort specification "%s".' % sort)
+    name = list(results)[FindColumn(list(results), name)]
+    sort_key = lambda index: Aggregates(name, index)[aggregate]
+  order = sorted(range(len(keys)), key=sort_key, reverse=True)
+  if limit:
+    order = order[:limit]
+
+  header = list(key_names) + ['Rows']
+  for name in results:
+    header += ['%s %s' % (name, aggregate) for aggregate in
+               ['sum', 'count', 'mean', 'max']]
+  print('\t'.join(header))
+  for index in order:
+    row = list(keys[index]) + ['%d' % row_counts[index]]
+    for name in results:
+      aggregates = Aggregates(name, index)
+      row += ['%1.3f' % aggregates['sum'], '%d' % aggregates['count'],
+              '%1.3f' % aggregates['mean'], '%1.3f' % aggregates['max']]
+    print('\t'.join(row))
+
+def ReadClipboard():
+  """
+  Return the lines of text on the clipboard.
+  """
+  import win32clipboard
   win32clipboard.OpenClipboard()
   data = win32clipboard.GetClipboardData()
   win32clipboard.CloseClipboard()
+  return data.splitlines()
 
-  sum = 0
-  min = 1e100
-  max = 0
-  count = 0
+def ReadInputs(paths):
+  """
+  Generate the lines from the specified files, where '-' means stdin.
+  """
+  for path in paths:
+    if path == '-':
+      for line in sys.stdin:
+        yield line
+    else:
+      with open(path, 'r') as f:
+        for line in f:
+          yield line
+
+def Summarize(lines, approximate=False):
+  """
+  Return a Stats object for the numeric lines in lines, and the number of lines
+  that weren't numeric.
+  """
+  stats = Stats(approximate)
   missed_count = 0
-  for line in data.splitlines():
+  batch = []
+  for line in lines:
+    batch.append(line)
+    if len(batch) >= batch_size:
+      values, missed = ParseBatch(batch)
+      stats.AddBatch(values)
+      missed_count += missed
+      batch = []
+  if batch:
+    values, missed = ParseBatch(batch)
+    stats.AddBatch(values)
+    missed_count += missed
+  return stats, missed_count
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('files', nargs='*', help='Files to read, or - for stdin. '
+                      'Defaults to stdin if it is redirected, otherwise the '
+                      'clipboard.')
+  parser.add_argument('--approximate', help='Calculate percentiles in bounded '
+                      'memory, to within 1%%.', action='store_true')
+  parser.add_argument('--group-by', help='Comma separated key columns of a '
+                      'table with a header row to group by.')
+  parser.add_argument('--columns', help='Comma separated numeric columns to '
+                      'aggregate with --group-by. Defaults to all other '
+                      'columns.')
+  parser.add_argument('--sort', help='Aggregate to sort --group-by output by, '
+                      'as "rows" or "column:sum|count|mean|max". Defaults to '
+                      'the sum of the first column.')
+  parser.add_argument('--limit', help='Number of groups to print.', type=int)
+  args = parser.parse_args()
+
+  if args.files:
+    lines = ReadInputs(args.files)
+  elif not sys.stdin.isatty():
+    lines = sys.stdin
+  else:
+    lines = ReadClipboard()
+
+  if args.group_by:
+    key_names = args.group_by.split(',')
+    column_names = args.columns.split(',') if args.columns else []
     try:
-      val = float(line.replace(',', '').replace('%', ''))
-      count += 1
-      sum += val
-      if val < min:
-        min = val
-      if val > max:
-        max = val
-    except:
-      missed_count += 1
+      keys, row_counts, results = GroupTable(lines, key_names, column_names)
+      sort = args.sort
+      if not sort:
+        sort = '%s:sum' % list(results)[0] if results else 'rows'
+      PrintGroups(key_names, keys, row_counts, results, sort, args.limit)
+    except (ValueError, StopIteration) as e:
+      print(e if str(e) else 'No data found.')
+      return 1
+    return 0
 
-  if count > 0:
-    print("Found %d values, sum is %1.3f, min %1.3f, avg %1.3f, max %1.3f." % (count, sum, min, sum / count, max))
+  stats, missed_count = Summarize(lines, args.approximate)
+  if stats.count > 0:
+    print("Found %d values, sum is %1.3f, min %1.3f, avg %1.3f, max %1.3f." % (stats.count, stats.sum, stats.min, stats.sum / stats.count, stats.max))
+    median, p90, p99, p999 = stats.Quantiles([0.5, 0.9, 0.99, 0.999])
+    print("median %1.3f, p90 %1.3f, p99 %1.3f, p99.9 %1.3f, stddev %1.3f." % (median, p90, p99, p999, stats.StdDev()))
   if missed_count > 0:
     print("Found %d non-numeric values" % missed_count)
 
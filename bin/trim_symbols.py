@@ -29,90 +29,366 @@ blast away most of the files in a directory if you pass it the wrong path.
 However it contains some basic sanity checks. In particular, it will only delete
 files if the file names match the grandparent directory, and if there is just
 one file in the directory.
+
+The symbol cache is scanned with a pool of threads, one task per binary
+directory, to produce a plan of the files and directories to delete. Pass
+--dry-run to print the plan, as JSON lines, without deleting anything.
+Otherwise the deletions are also done in parallel.
+
+Alternately, --max-size sets a budget for the total size of the symbol cache.
+In that mode GUID directories across the whole cache are ranked by age (last
+modification or, with --use-access-time, last access) multiplied by size and
+the highest ranked are evicted until the cache fits. The same sanity checks
+apply, and a summary of how much each binary gave up is printed.
+
+The results of each scan are saved in an inventory file so that later runs only
+rescan binary directories whose mtime has changed, and --report can show the
+size of the cache by binary name without touching the cache at all. Changes
+inside an existing GUID directory don't update the binary directory's mtime, so
+use --rescan occasionally to pick those up.
 """
 
 from __future__ import print_function
 
+import argparse
+import collections
+import concurrent.futures
+import instrumentation
+import json
 import os
 import sys
+import time
+
+# A single step of the deletion plan. kind is 'file' or 'dir' for things to be
+# deleted, or 'keep' for a GUID directory that is being left alone because it
+# doesn't look like part of a symbol cache. symbol is the name of the binary
+# directory that the action applies to.
+Action = collections.namedtuple('Action', ['kind', 'path', 'size', 'symbol'])
+
+inventory_name = 'trim_symbols_inventory.json'
+
+# The scanned contents of one GUID directory. files is a list of
+# (name, path, size) tuples and size is their total size. last_access is the
+# most recent access time of the files, or the mtime if there are none.
+GuidDir = collections.namedtuple('GuidDir', ['symbol', 'path', 'mtime',
+                                             'last_access', 'size', 'files'])
+
+def ScanSymbol(symbol_cache_dir, symbol):
+  r"""
+  Return a list of GuidDir entries for one binary directory, such as
+  c:\symbols\chrome.dll.pdb, sorted by mtime.
+  """
+  # eg.: c:\symbols\chrome.dll.pdb
+  outer_symbol_path = os.path.join(symbol_cache_dir, symbol)
+  # eg.: c:\symbols\chrome.dll.pdb\A982846B8C61458C9C4C3E33C6FA8F511
+  # scandir returns the mtime without an extra system call on Windows.
+  with os.scandir(outer_symbol_path) as it:
+    inner_symbol_dirs = [(entry.stat().st_mtime, entry.path) for entry in it]
+  # Sort by date
+  inner_symbol_dirs.sort()
+  return [ScanGuidDir(symbol, inner_symbol_path, mtime)
+          for mtime, inner_symbol_path in inner_symbol_dirs]
+
+def ScanGuidDir(symbol, path, mtime):
+  """
+  Return a GuidDir entry for one GUID directory of the specified binary.
+  """
+  files = []
+  last_access = mtime
+  with os.scandir(path) as it:
+    for entry in it:
+      stat = entry.stat()
+      files.append((entry.name, entry.path, stat.st_size))
+      last_access = max(last_access, stat.st_atime)
+  return GuidDir(symbol, path, mtime, last_access,
+                 sum(file[2] for file in files), files)
+
+def PlanGuidDir(guid_dir):
+  """
+  Return the list of actions that deletes a GUID directory, or a 'keep' action
+  if the directory doesn't look like part of a symbol cache. The actions must be
+  done in order, and the last one is always for the directory itself.
+  """
+  actions = []
+  files = []
+  for name, path, size in guid_dir.files:
+    # Files that end with .error are sometimes present due to symbol-server
+    # download errors. Delete them. Files that end with '_' are compressed
+    # files that can't be used directly and are not supposed to be
+    # retained. Delete them.
+    if name.endswith('.error') or name.endswith('_'):
+      actions.append(Action('file', path, size, guid_dir.symbol))
+    else:
+      files.append((name, path, size))
+  # If there are extra files or if the file name doesn't match the parent
+  # directory then maybe this isn't a symbol cache.
+  if len(files) == 1 and files[0][0].lower() == guid_dir.symbol.lower():
+    actions.append(Action('file', files[0][1], files[0][2], guid_dir.symbol))
+    actions.append(Action('dir', guid_dir.path, 0, guid_dir.symbol))
+  elif len(files) == 0:
+    actions.append(Action('dir', guid_dir.path, 0, guid_dir.symbol))
+  else:
+    actions.append(Action('keep', guid_dir.path, 0, guid_dir.symbol))
+  return actions
+
+def ScanCache(symbol_cache_dir, workers, inventory=None):
+  """
+  Return a list of GuidDir entries for the entire symbol cache and an inventory
+  that maps each binary directory name to its mtime and GuidDir entries. Binary
+  directories whose mtime matches the passed in inventory are not scanned
+  again, and the rest are scanned in parallel.
+  """
+  inventory = inventory or {}
+  with os.scandir(symbol_cache_dir) as it:
+    mtimes = {entry.name: entry.stat().st_mtime for entry in it
+              if entry.is_dir() and os.path.splitext(entry.name)[1].lower() in
+              ['.pdb', '.exe', '.dll', '.drv']}
+  new_inventory = {}
+  stale = []
+  for symbol, mtime in mtimes.items():
+    if symbol in inventory and inventory[symbol][0] == mtime:
+      new_inventory[symbol] = inventory[symbol]
+    else:
+      stale.append(symbol)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    for symbol, symbol_guid_dirs in zip(stale, executor.map(
+        lambda symbol: ScanSymbol(symbol_cache_dir, symbol), stale)):
+      new_inventory[symbol] = (mtimes[symbol], symbol_guid_dirs)
+  guid_dirs = []
+  for mtime, symbol_guid_dirs in new_inventory.values():
+    guid_dirs.extend(symbol_guid_dirs)
+  return guid_dirs, new_inventory
+
+def LoadInventory(inventory_path, symbol_cache_dir):
+  """
+  Return the inventory saved by SaveInventory, or an empty inventory if there
+  isn't one for this symbol cache directory.
+  """
+  try:
+    with open(inventory_path, 'r', encoding='utf-8') as f:
+      data = json.load(f)
+  except (OSError, ValueError):
+    return {}
+  if data.get('symbol_cache_dir') != symbol_cache_dir:
+    return {}
+  inventory = {}
+  for symbol, (mtime, guid_dirs) in data['symbols'].items():
+    inventory[symbol] = (mtime, [GuidDir(symbol, path, guid_mtime, last_access,
+                                         size, [tuple(file) for file in files])
+                                 for path, guid_mtime, last_access, size, files
+                                 in guid_dirs])
+  return inventory
+
+def SaveInventory(inventory_path, symbol_cache_dir, inventory):
+  """
+  Save the inventory for LoadInventory, with the symbol cache directory that
+  it describes. The old file is only replaced once the new one is complete.
+  """
+  data = {'symbol_cache_dir': symbol_cache_dir, 'symbols': {}}
+  for symbol, (mtime, guid_dirs) in inventory.items():
+    data['symbols'][symbol] = (mtime, [guid_dir[1:] for guid_dir in guid_dirs])
+  temp_path = inventory_path + '.tmp'
+  with open(temp_path, 'w', encoding='utf-8') as f:
+    json.dump(data, f)
+  os.replace(temp_path, inventory_path)
+
+def PrintReport(inventory):
+  """
+  Print the size of the symbol cache by binary name, largest first.
+  """
+  sizes = []
+  for symbol, (mtime, guid_dirs) in inventory.items():
+    sizes.append((sum(guid_dir.size for guid_dir in guid_dirs), len(guid_dirs),
+                  symbol))
+  sizes.sort(reverse=True)
+  for size, count, symbol in sizes:
+    print('%8.3f GB in %d directories of %s' % (size / 1e9, count, symbol))
+  print('%8.3f GB total' % (sum(size[0] for size in sizes) / 1e9))
+
+def PlanKeepNewest(guid_dirs):
+  """
+  Return a deletion plan, as a list of lists of actions, that deletes all but
+  the two most recent GUID directories for each binary.
+  """
+  by_symbol = collections.defaultdict(list)
+  for guid_dir in guid_dirs:
+    by_symbol[guid_dir.symbol].append(guid_dir)
+  plan = []
+  for symbol_guid_dirs in by_symbol.values():
+    symbol_guid_dirs.sort(key=lambda guid_dir: guid_dir.mtime)
+    # Iterate over all but the most recent entries
+    # Retain the last two because there may be 32-bit/64-bit binaries with the
+    # same name but different symbols, or development/stable versions.
+    for guid_dir in symbol_guid_dirs[:-2]:
+      plan.append(PlanGuidDir(guid_dir))
+  return plan
+
+def PlanMaxSize(guid_dirs, max_size, use_access_time):
+  """
+  Return a deletion plan, as a list of lists of actions, that brings the total
+  size of the cache down to max_size bytes. GUID directories are evicted in
+  order of their age multiplied by their size, so that large directories that
+  haven't been used for a while go first. Age is based on the last access time
+  if use_access_time is True, otherwise on the mtime.
+  """
+  total_size = sum(guid_dir.size for guid_dir in guid_dirs)
+  now = time.time()
+  def Score(guid_dir):
+    last_used = guid_dir.last_access if use_access_time else guid_dir.mtime
+    return max(now - last_used, 0) * guid_dir.size
+  plan = []
+  for guid_dir in sorted(guid_dirs, key=Score, reverse=True):
+    if total_size <= max_size:
+      break
+    actions = PlanGuidDir(guid_dir)
+    # Directories that fail the sanity checks can't be evicted, so keep looking.
+    if actions[-1].kind == 'keep':
+      continue
+    plan.append(actions)
+    total_size -= guid_dir.size
+  return plan
+
+def PrintSummary(plan):
+  """
+  Print how much space each binary name gives up under the plan.
+  """
+  freed = collections.Counter()
+  dirs = collections.Counter()
+  for actions in plan:
+    for action in actions:
+      if action.kind == 'file':
+        freed[action.symbol] += action.size
+      elif action.kind == 'dir':
+        dirs[action.symbol] += 1
+  for symbol, size in freed.most_common():
+    print('%8.3f GB from %d directories of %s' % (size / 1e9, dirs[symbol],
+                                                 symbol))
+
+def ExecuteActions(actions):
+  """
+  Do the actions for one GUID directory, stopping at the first failure. Returns
+  the number of files deleted, their total size, and the number of failures.
+  The plan may come from the inventory, which doesn't see changes inside GUID
+  directories, so the directory is scanned and planned again first to make sure
+  that the sanity checks pass on its current contents.
+  """
+  deleted_count = 0
+  deleted_size = 0
+  guid_dir_path = actions[-1].path
+  try:
+    actions = PlanGuidDir(ScanGuidDir(actions[-1].symbol, guid_dir_path,
+                                      os.path.getmtime(guid_dir_path)))
+  except OSError as e:
+    print('Failure scanning %s - %s' % (guid_dir_path, e))
+    return deleted_count, deleted_size, 1
+  for action in actions:
+    if action.kind == 'keep':
+      print('File/directory mismatch. Leaving %s, just in case.' % action.path)
+      continue
+    print('removing %s' % action.path)
+    try:
+      if action.kind == 'file':
+        os.remove(action.path)
+        deleted_size += action.size
+        deleted_count += 1
+      else:
+        os.rmdir(action.path)
+    except OSError as e:
+      print('Failure deleting %s - %s' % (action.path, e))
+      return deleted_count, deleted_size, 1
+  return deleted_count, deleted_size, 0
 
 def main():
-  symbol_cache_dir = r'c:\symbols'
-  if len(sys.argv) > 1:
-    symbol_cache_dir = sys.argv[1]
+  parser = argparse.ArgumentParser()
+  parser.add_argument('symbol_cache_dir', nargs='?', default=r'c:\symbols',
+                      help='Symbol cache directory to trim.')
+  parser.add_argument('--dry-run', help='Print the deletion plan as JSON lines '
+                      'instead of deleting anything.', action='store_true')
+  parser.add_argument('--workers', help='Number of threads to use for scanning '
+                      'and deleting.', type=int, default=8)
+  parser.add_argument('--max-size', help='Instead of keeping the two newest '
+                      'versions of each binary, evict the least recently used '
+                      'versions, weighted by size, until the cache fits in '
+                      'this many GB.', type=float)
+  parser.add_argument('--use-access-time', help='With --max-size, rank by last '
+                      'access time instead of modification time. Access times '
+                      'are not updated by default on some file systems.',
+                      action='store_true')
+  parser.add_argument('--inventory', help='File that records the contents of '
+                      'the cache between runs. Defaults to %s in the symbol '
+                      'cache directory.' % inventory_name)
+  parser.add_argument('--rescan', help='Ignore the inventory and scan the '
+                      'entire cache.', action='store_true')
+  parser.add_argument('--report', help='Print the size of the cache by binary '
+                      'name from the inventory, without scanning or deleting.',
+                      action='store_true')
+  instrumentation.AddArguments(parser)
+  args = parser.parse_args()
+  instrumentation.Start('trim_symbols', args)
+  symbol_cache_dir = args.symbol_cache_dir
 
   if not os.path.isdir(symbol_cache_dir):
     print('"%s" is not a directory.' % symbol_cache_dir)
     return 1
 
+  inventory_path = args.inventory or os.path.join(symbol_cache_dir,
+                                                  inventory_name)
+  # Access times change without changing the directory mtimes, so the
+  # inventory can't be trusted for them.
+  if args.rescan or args.use_access_time:
+    inventory = {}
+  else:
+    with instrumentation.Phase('load inventory'):
+      inventory = LoadInventory(inventory_path, symbol_cache_dir)
+  if args.report:
+    if not inventory:
+      print('No inventory found for %s, run without --report first.' %
+            symbol_cache_dir)
+      return 1
+    PrintReport(inventory)
+    return 0
+
+  with instrumentation.Phase('scan'):
+    guid_dirs, inventory = ScanCache(symbol_cache_dir, args.workers, inventory)
+    SaveInventory(inventory_path, symbol_cache_dir, inventory)
+    instrumentation.Count('guid_dirs', len(guid_dirs))
+  with instrumentation.Phase('plan'):
+    if args.max_size is not None:
+      total_size = sum(guid_dir.size for guid_dir in guid_dirs)
+      print('Symbol cache is %1.3f GB, budget is %1.3f GB' %
+            (total_size / 1e9, args.max_size))
+      plan = PlanMaxSize(guid_dirs, args.max_size * 1e9, args.use_access_time)
+    else:
+      plan = PlanKeepNewest(guid_dirs)
+  if args.dry_run:
+    planned_size = 0
+    for actions in plan:
+      for action in actions:
+        print(json.dumps(action._asdict()))
+        planned_size += action.size
+    print('Would delete %1.3f GB' % (planned_size / 1e9))
+    PrintSummary(plan)
+    return 0
+
   deleted_count = 0
   deleted_size = 0
   failed_count = 0
-  for symbol in os.listdir(symbol_cache_dir):
-    ext = os.path.splitext(symbol)[1]
-    if ext.lower() in ['.pdb', '.exe', '.dll', '.drv']:
-      # eg.: c:\symbols\chrome.dll.pdb
-      outer_symbol_path = os.path.join(symbol_cache_dir, symbol)
-      # eg.: c:\symbols\chrome.dll.pdb\A982846B8C61458C9C4C3E33C6FA8F511
-      inner_symbol_dirs = []
-      for inner_symbol_dir in os.listdir(outer_symbol_path):
-        mtime = os.path.getmtime(os.path.join(outer_symbol_path, inner_symbol_dir))
-        inner_symbol_dirs.append((mtime, inner_symbol_dir))
-      # Sort by date
-      inner_symbol_dirs.sort()
-      # Iterate over all but the most recent entries
-      # Retain the last two because there may be 32-bit/64-bit binaries with the
-      # same name but different symbols, or development/stable versions.
-      for guid_path in inner_symbol_dirs[:-2]:
-        inner_symbol_path = os.path.join(outer_symbol_path, guid_path[1])
-        files = os.listdir(inner_symbol_path)
-        deleted_error_files = False
-        for file in files:
-          # Files that end with .error are sometimes present due to symbol-server
-          # download errors. Delete them. Files that end with '_' are compressed
-          # files that can't be used directly and are not supposed to be
-          # retained. Delete them.
-          if file.endswith('.error') or file.endswith('_'):
-            file_path = os.path.join(inner_symbol_path, file)
-            print('removing %s' % file_path)
-            try:
-              file_size = os.path.getsize(file_path)
-              os.remove(file_path)
-              deleted_size += file_size
-              deleted_count += 1
-            except WindowsError as e:
-              print('Failure deleting %s - %s' % (file_path, e))
-              failed_count += 1
-            deleted_error_files = True
-        # If we deleted some .error files then rescan.
-        if deleted_error_files:
-          files = os.listdir(inner_symbol_path)
-        # If there are extra files or if the file name doesn't match the parent
-        # directory then maybe this isn't a symbol cache.
-        if len(files) == 1 and files[0].lower() == symbol.lower():
-          file_path = os.path.join(inner_symbol_path, files[0])
-          print('removing %s' % file_path)
-          try:
-            file_size = os.path.getsize(file_path)
-            os.remove(file_path)
-            print('removing %s' % inner_symbol_path)
-            os.rmdir(inner_symbol_path)
-            deleted_size += file_size
-            deleted_count += 1
-          except WindowsError as e:
-            print('Failure deleting %s - %s' % (file_path, e))
-            failed_count += 1
-        elif len(files) == 0:
-          try:
-            print('removing %s' % inner_symbol_path)
-            os.rmdir(inner_symbol_path)
-          except WindowsError as e:
-            print('Failure deleting %s - %s' % (inner_symbol_path, e))
-            failed_count += 1
-        else:
-          print('File/directory mismatch. Leaving %s, just in case.' % inner_symbol_path)
+  with instrumentation.Phase('delete'), \
+       concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+    for count, size, failed in executor.map(ExecuteActions, plan):
+      deleted_count += count
+      deleted_size += size
+      failed_count += failed
+    instrumentation.Count('files', deleted_count)
+    instrumentation.Count('bytes', deleted_size)
   # GB = 1e9. GiB = 2^30 and is dumb in this context.
   print('Deleted %d files totaling %1.3f GB' % (deleted_count, deleted_size / 1e9))
+  PrintSummary(plan)
+  # Deleting GUID directories changes the mtime of their binary directories so
+  # this only rescans the binaries that were trimmed.
+  with instrumentation.Phase('rescan'):
+    guid_dirs, inventory = ScanCache(symbol_cache_dir, args.workers, inventory)
+    SaveInventory(inventory_path, symbol_cache_dir, inventory)
   if failed_count > 1:
     print('Failed to delete %d file(s)' % failed_count)
 
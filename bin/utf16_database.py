@@ -0,0 +1,183 @@
+# Copyright 2021 Bruce Dawson. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""
+Streaming reader for the UTF-16 tab-separated photo databases, such as
+~\Documents\PhotoDatabase.txt, that are shared with some C# tools.
+
+Reading these with f.read().decode('utf-16').splitlines() holds the raw bytes,
+the decoded string, and the list of lines in memory at the same time, which is
+three to four times the size of the file. This module instead memory-maps the
+file and decodes it a chunk at a time, so peak memory use doesn't depend on the
+size of the database. The incremental decoder takes care of surrogate pairs and
+odd bytes that are split across chunks.
+
+Run this module directly to compare the two approaches on a database:
+
+  python3 utf16_database.py PhotoDatabase.txt
+"""
+
+import codecs
+import mmap
+import os
+import subprocess
+import sys
+import time
+
+chunk_size = 1 << 20
+
+def DetectEncoding(bom):
+  """
+  Return the encoding and the BOM size implied by the first two bytes of a
+  UTF-16 file. Files without a BOM are assumed to be little-endian, which is
+  what C# and Python write by default.
+  """
+  if bom == codecs.BOM_UTF16_BE:
+    return 'utf-16-be', 2
+  if bom == codecs.BOM_UTF16_LE:
+    return 'utf-16-le', 2
+  return 'utf-16-le', 0
+
+def GetEncoding(path):
+  """
+  Return the encoding and the BOM size of the specified UTF-16 file.
+  """
+  with open(path, 'rb') as f:
+    return DetectEncoding(f.read(2))
+
+def ReadLines(path, with_offsets=False):
+  """
+  Generate the lines of the specified UTF-16 file without their line endings.
+  If with_offsets is True then (byte offset, byte length, line) tuples are
+  generated instead, suitable for passing to ReadLineAt. The length excludes
+  the line ending.
+  """
+  with open(path, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    # Zero-length files can't be memory-mapped.
+    if size == 0:
+      return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      encoding, pos = DetectEncoding(data[:2])
+      decoder = codecs.getincrementaldecoder(encoding)()
+      newline_size = len('\n'.encode(encoding))
+      offset = pos
+      pending = ''
+      while pos < size:
+        chunk = data[pos:pos + chunk_size]
+        pos += len(chunk)
+        lines = (pending + decoder.decode(chunk, final=pos >= size)).split('\n')
+        # The last piece may be an incomplete line.
+        pending = lines.pop()
+        for line in lines:
+          if with_offsets:
+            length = len(line.encode(encoding))
+            yield offset, length, line.rstrip('\r')
+            offset += length + newline_size
+          else:
+            yield line.rstrip('\r')
+        # Let the OS discard the pages that have been decoded so that they don't
+        # count against the resident set size.
+        if hasattr(mmap, 'MADV_DONTNEED'):
+          data.madvise(mmap.MADV_DONTNEED, 0, pos - pos % mmap.PAGESIZE)
+      if pending:
+        if with_offsets:
+          yield offset, len(pending.encode(encoding)), pending.rstrip('\r')
+        else:
+          yield pending.rstrip('\r')
+
+def ReadRecords(path):
+  """
+  Generate a list of the tab-separated fields for each non-blank line of the
+  specified UTF-16 file.
+  """
+  for line in ReadLines(path):
+    if line:
+      yield line.split('\t')
+
+def ReadLineAt(f, offset, encoding, length=None):
+  """
+  Return the line that starts at the specified byte offset of an open UTF-16
+  file. If the byte length of the line is known then exactly that much is read,
+  otherwise the file is read until the end of the line.
+  """
+  f.seek(offset)
+  if length is not None:
+    return f.read(length).decode(encoding).rstrip('\r')
+  decoder = codecs.getincrementaldecoder(encoding)()
+  text = ''
+  while True:
+    chunk = f.read(4096)
+    text += decoder.decode(chunk, final=not chunk)
+    end = text.find('\n')
+    if end >= 0:
+      return text[:end].rstrip('\r')
+    if not chunk:
+      return text.rstrip('\r')
+
+def GetPeakMemory():
+  """
+  Return the peak resident set size of this process in bytes, or None if it
+  can't be determined.
+  """
+  try:
+    import resource
+  except ImportError:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+def Measure(method, path):
+  """
+  Read all of the records from path with the specified method and print the
+  elapsed time, peak memory, and record count.
+  """
+  start = time.time()
+  count = 0
+  if method == 'read':
+    with open(path, 'rb') as f:
+      lines = f.read().decode('utf-16').splitlines()
+    for line in lines:
+      if line:
+        line.split('\t')
+        count += 1
+  else:
+    for record in ReadRecords(path):
+      count += 1
+  print('%f %s %d' % (time.time() - start, GetPeakMemory(), count))
+
+def main():
+  if len(sys.argv) == 4 and sys.argv[1] == '--measure':
+    Measure(sys.argv[2], sys.argv[3])
+    return 0
+  if len(sys.argv) != 2:
+    print('Usage: %s database' % sys.argv[0])
+    return 1
+  path = sys.argv[1]
+  print('%s is %1.3f MB.' % (path, os.path.getsize(path) / 1e6))
+  # Each method is measured in a separate process so that the peak memory of
+  # one doesn't hide the peak memory of the other.
+  for method in ['read', 'stream']:
+    output = subprocess.check_output([sys.executable, __file__, '--measure',
+                                      method, path], text=True)
+    elapsed, peak, count = output.split()
+    peak = '%1.1f MB' % (int(peak) / 1e6) if peak != 'None' else 'unknown'
+    print('%-6s: %s records in %1.3f s, peak memory %s.' %
+          (method, count, float(elapsed), peak))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())